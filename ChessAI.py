@@ -1,14 +1,13 @@
 import random
+import time
 import numpy as np
+from ChessBook import OpeningBook
+from ChessEngine import getCaptureOrder, PIECE_CODES, PIECE_VALUES
+from ChessSearchStats import SearchStats, profileCall
+from ChessTablebase import Tablebase, WIN, LOSS
+from ChessTransposition import TranspositionTable, EXACT, LOWERBOUND, UPPERBOUND
 
-pieceScores = {
-    "K": 0,
-    "Q": 10,
-    "R": 5,
-    "B": 3,
-    "N": 3,
-    "p": 1,
-}
+pieceScores = PIECE_VALUES #one table for the evaluation and the capture ordering of both move generators
 
 
 knightScores = [[-50,-40,-30,-30,-30,-30,-40,-50],
@@ -90,10 +89,71 @@ piecePositionScores = {
     "K": kingScores
 }
 
+#tables used by the incremental evaluation kept by ChessEngine.GameState, see enableIncrementalEval.
+#They give the same values as score(): material for the piece and the positional score of its square, black negative
+pieceMaterialTable = {color + piece: sign * pieceScores[piece]
+                      for color, sign in (('w', 1), ('b', -1)) for piece in pieceScores}
+piecePositionTable = {color + piece: [sign * piecePositionScores[color + piece if piece == 'p' else piece][sq // 8][sq % 8]
+                                      for sq in range(64)]
+                      for color, sign in (('w', 1), ('b', -1)) for piece in pieceScores}
+
+#the same tables as NumPy weights for the batch evaluation (see evaluateBatch): one row of 64 squares per piece, in
+#the order of ChessEngine.PIECE_CODES (white pawn to black king), square = row * 8 + col with row 0 the 8th rank
+materialWeights = np.array([[pieceMaterialTable[piece]] * 64 for piece in PIECE_CODES], dtype=np.float64)
+positionWeights = np.array([piecePositionTable[piece] for piece in PIECE_CODES], dtype=np.float64)
+squareCodes = {'--': 0, **{piece: i + 1 for i, piece in enumerate(PIECE_CODES)}} #board square -> code, see encodeBoards
+
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 4
-nextMove = None
+DRAW = 0 #repetition or fifty-move rule, inside the search
+DEPTH = 4 #maximum depth of the iterative deepening
+TIME_LIMIT = None #seconds per move, None for no limit
+NODE_LIMIT = None #nodes per move, None for no limit
+TT_SIZE_MB = 16
+OPENING_BOOK = None #path of a Polyglot opening book (.bin) to play the moves it knows without searching, None for none
+TABLEBASE_PATH = None #directory of Syzygy tablebases (.rtbw/.rtbz files) for the endgames, None for none
+TABLEBASE_PIECES = 5 #probe the tablebases in positions with at most this many pieces, kings included
+TABLEBASE_WIN = CHECKMATE / 2 #score of a won tablebase position, above any material but below a checkmate
+POSITION_WEIGHT = 1./50 #weight of the piece-square scores with respect to the material
+INCREMENTAL_EVAL = True #let the game state keep the evaluation up to date instead of scanning the board at every leaf
+CHECK_INCREMENTAL_EVAL = False #debug: compare the incremental evaluation with score() at every leaf
+RANDOM_TIEBREAK = True #shuffle the moves before ordering them, so equally ranked moves are tried in random order
+QUIESCENCE = True #at depth 0 keep searching the captures, instead of evaluating a position in the middle of an exchange
+DELTA_MARGIN = 2 #quiescence: skip a capture if even winning the piece plus this margin can't reach the bound
+SEARCH_ALGORITHMS = ('minimax', 'pvs')
+SEARCH_ALGORITHM = 'pvs' #'minimax': alpha-beta with separate max/min branches, 'pvs': negamax principal variation search
+PVS_EPSILON = 1e-3 #width of the null windows, well below the smallest score difference (1/50 of a pawn)
+ASPIRATION_WINDOW = 0.5 #pvs: first window of an iteration, around the score of the previous one
+#selective search, pvs only
+NULL_MOVE_PRUNING = True #let the opponent move twice: if the search still fails high, cut without searching the moves
+NULL_MOVE_REDUCTION = 2 #the null move is searched this much shallower (on top of the ply it uses)
+NULL_MOVE_MIN_DEPTH = 3
+LATE_MOVE_REDUCTIONS = True #search the quiet moves ordered late one ply shallower, again at full depth if they beat alpha
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3 #moves searched at full depth before the reductions start
+FUTILITY_PRUNING = True #near the leaves, skip the quiet moves when the static evaluation is far below alpha
+FUTILITY_MARGINS = (None, 2, 5) #by remaining depth, the most a quiet move is expected to gain
+MAX_PLY = 64
+
+#move ordering scores
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000 #plus the MVV-LVA score
+KILLER_SCORES = (90000, 89000)
+MAX_HISTORY_SCORE = 80000
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+'''
+The search limits with the ones not given (None) taken from DEPTH, TIME_LIMIT and NODE_LIMIT, read at call time so
+that changing the module constants applies to the next search
+'''
+def getLimits(maxDepth=None, timeLimit=None, nodeLimit=None):
+    return (DEPTH if maxDepth is None else maxDepth,
+            TIME_LIMIT if timeLimit is None else timeLimit,
+            NODE_LIMIT if nodeLimit is None else nodeLimit)
 
 
 def findRandomMove(validMoves):
@@ -101,85 +161,604 @@ def findRandomMove(validMoves):
     return validMoves[i]
 
 
-def findBestMove(gs, validMoves, returnQueue):
-    global nextMove
-    '''
-    turnMultiplier = 1 if gs.whiteToMove else -1
-    opponentMinMaxScore = CHECKMATE
-    bestPlayerMove = None
-    for playerMove in validMoves:
-        gs.makeMove(playerMove)
-        opponentsMoves = gs.getValidMoves()
-        opponentMaxScore = -CHECKMATE
-        for opponentMove in opponentsMoves:
-            gs.makeMove(opponentMove)
-            if gs.checkMate:
-                score = -turnMultiplier*CHECKMATE
-            elif gs.staleMate:
-                score = STALEMATE
-            score = -turnMultiplier*scoreMaterial(gs.board)
-            if (score > opponentMaxScore):
-                opponentMaxScore = score
+'''
+Search the best move and put it in returnQueue, or (best move, statistics of the search as a dict) if returnStats.
+The search runs in a new Searcher unless one is given. The limits left None are read from DEPTH, TIME_LIMIT and
+NODE_LIMIT when the search starts
+'''
+def findBestMove(gs, validMoves, returnQueue, maxDepth=None, timeLimit=None, nodeLimit=None, returnStats=False,
+                 searcher=None):
+    searcher = searcher or Searcher()
+    bestMove = searcher.searchBestMove(gs, validMoves, maxDepth, timeLimit, nodeLimit)
+    returnQueue.put((bestMove, searcher.searchStats.toDict()) if returnStats else bestMove)
+
+
+'''
+A search context: the limits and counters of the running search, the transposition table, the move ordering tables,
+and the result and statistics of the last search. Searchers share no mutable state, so several of them can search
+at the same time in one process (one per thread, per game, per analysed position...). Reusing a Searcher from move to
+move keeps its transposition table warm. The module constants (QUIESCENCE, NULL_MOVE_PRUNING...) are read only
+'''
+class Searcher():
+
+    def __init__(self, algorithm=None, ttSizeMB=None, bookPath=None, tablebasePath=None,
+                 tablebasePieces=None):
+        self.algorithm = algorithm or SEARCH_ALGORITHM #one of SEARCH_ALGORITHMS
+        self.transpositionTable = TranspositionTable(ttSizeMB or TT_SIZE_MB)
+        bookPath = bookPath or OPENING_BOOK
+        self.book = OpeningBook(bookPath) if bookPath is not None else None
+        tablebasePath = tablebasePath or TABLEBASE_PATH
+        if tablebasePieces is None:
+            tablebasePieces = TABLEBASE_PIECES
+        self.tablebase = Tablebase(tablebasePath, tablebasePieces) if tablebasePath is not None else None
+        self.killerMoves = [[None, None] for _ in range(MAX_PLY)] #per ply, the last two quiet moves that caused a cutoff
+        self.historyScores = {} #(piece moved, end square) -> how often and how deep that quiet move caused a cutoff
+        self.moveBuffers = [[] for _ in range(MAX_PLY)] #per ply, the list the moves of the node are generated into
+        #state of the running search
+        self.deadline = None
+        self.nodeLimit = None
+        self.stopSignal = None #anything with an is_set method (e.g. a multiprocessing.Event), the search stops once it is set
+        self.nodesSearched = 0 #quiescence nodes included
+        self.quiescenceNodes = 0
+        self.rootMove = None #best root move of the running iteration
+        #result of the last search
+        self.bestMove = None
+        self.searchScore = None #score of the last completed iteration
+        self.principalVariation = [] #moves of the principal variation of the last completed iteration
+        self.searchStats = SearchStats() #statistics of the running (or last) search
+
+
+    '''
+    Search the best move, or play a move of the opening book if there is one for the position, or the move of the
+    tablebases in an endgame they cover. The limits left None are read from DEPTH, TIME_LIMIT and NODE_LIMIT.
+    stopSignal stops the search early once it is set. The statistics of the search are left in searchStats.
+    profiler ('cprofile' or 'tracemalloc') prints a profile of the search, see ChessSearchStats.profileCall
+    '''
+    def searchBestMove(self, gs, validMoves, maxDepth=None, timeLimit=None, nodeLimit=None, stopSignal=None,
+                       profiler=None):
+        if self.book is not None:
+            bookMove = self.book.chooseMove(gs, validMoves)
+            if bookMove is not None:
+                self.startSearch()
+                self.searchStats.finish(0, 0, self.transpositionTable.getStats())
+                self.bestMove = bookMove
+                return bookMove
+        if self.tablebase is not None and self.tablebase.canProbe(gs):
+            tablebaseMove = self.tablebase.getBestMove(gs, validMoves)
+            if tablebaseMove is not None:
+                self.startSearch()
+                self.searchStats.finish(0, 0, self.transpositionTable.getStats())
+                self.bestMove = tablebaseMove
+                return tablebaseMove
+        if INCREMENTAL_EVAL and gs.positionTable is None:
+            gs.enableIncrementalEval(pieceMaterialTable, piecePositionTable)
+        maxDepth, timeLimit, nodeLimit = getLimits(maxDepth, timeLimit, nodeLimit)
+        self.bestMove = profileCall(profiler, self.iterativeDeepening, gs, validMoves, maxDepth, timeLimit, nodeLimit,
+                                    stopSignal)
+        return self.bestMove
+
+
+    '''
+    Set the limits of a new search and reset its counters and statistics. deadline is a time.time() value or None
+    '''
+    def startSearch(self, deadline=None, nodeLimit=None, stopSignal=None):
+        self.deadline = deadline
+        self.nodeLimit = nodeLimit
+        self.stopSignal = stopSignal
+        self.nodesSearched = 0
+        self.quiescenceNodes = 0
+        self.searchStats = SearchStats()
+        self.transpositionTable.resetStats()
+
+
+    '''
+    Search with increasing depth until maxDepth or until the time/node budget runs out, and return the best move of the
+    last completed iteration. Each iteration starts from the best moves found by the previous one (the root move and the
+    hash moves stored in the transposition table, i.e. the principal variation), which makes the deeper search faster
+    '''
+    def iterativeDeepening(self, gs, validMoves, maxDepth=None, timeLimit=None, nodeLimit=None, stopSignal=None):
+        maximizingPlayer = gs.whiteToMove
+        if maxDepth is None:
+            maxDepth = DEPTH
+        self.startSearch(time.time() + timeLimit if timeLimit is not None else None, nodeLimit, stopSignal)
+        bestMove = None
+        movesMade = len(gs.moveLog)
+        self.resetOrderingTables()
+        for depth in range(1, maxDepth + 1):
+            self.rootMove = None
+            try:
+                if self.algorithm == 'pvs':
+                    value = self.aspirationSearch(gs, validMoves, depth, 1 if maximizingPlayer else -1)
+                else:
+                    value = self.minimax(gs, validMoves, depth, -np.inf, np.inf, maximizingPlayer)
+            except SearchTimeout:
+                while len(gs.moveLog) > movesMade:
+                    gs.undoMove()
+                if bestMove is None: #not even the first iteration finished, take what it found so far
+                    bestMove = self.rootMove
+                break
+            bestMove = self.rootMove
+            self.searchScore = value
+            self.principalVariation = self.getPrincipalVariation(gs, depth)
+            self.searchStats.recordIteration(depth, value, self.nodesSearched, self.quiescenceNodes,
+                                             self.principalVariation)
+        self.deadline = None
+        self.nodeLimit = None
+        self.stopSignal = None
+        self.searchStats.finish(self.nodesSearched, self.quiescenceNodes, self.transpositionTable.getStats())
+        return bestMove
+
+
+    '''
+    Follow the best moves stored in the transposition table from the current position
+    '''
+    def getPrincipalVariation(self, gs, depth):
+        pv = []
+        for _ in range(depth):
+            moveID = self.transpositionTable.getBestMove(gs.zobristKey)
+            move = None
+            for m in gs.getValidMoves():
+                if m.moveID == moveID:
+                    move = m
+                    break
+            if move is None:
+                break
+            pv.append(move)
+            gs.makeMove(move)
+        for _ in pv:
             gs.undoMove()
-        if opponentMaxScore < opponentMinMaxScore :
-            opponentMinMaxScore = opponentMaxScore
-            bestPlayerMove = playerMove
-        gs.undoMove()
+        return pv
+
+
     '''
-    
-    maximizingPlayer = gs.whiteToMove
-    random.shuffle(validMoves)
-    bestScore = minimax(gs, validMoves, DEPTH, -np.inf, np.inf, maximizingPlayer)
+    Stop the search if it went over its time or node budget, or if it was asked to stop
+    '''
+    def checkLimits(self):
+        if self.nodeLimit is not None and self.nodesSearched >= self.nodeLimit:
+            raise SearchTimeout()
+        if self.nodesSearched % 64 == 0:
+            if self.deadline is not None and time.time() >= self.deadline:
+                raise SearchTimeout()
+            if self.stopSignal is not None and self.stopSignal.is_set():
+                raise SearchTimeout()
 
-    
-    
-    returnQueue.put( nextMove)
 
+    def resetOrderingTables(self):
+        for killers in self.killerMoves:
+            killers[0] = killers[1] = None
+        self.historyScores = {}
 
-'''
-Minimax algorithm
-'''
-def minimax(gs, validMoves, depth, alpha, beta, maximizingPlayer):
-    global nextMove
-    if depth == 0:
-        return score(gs)
 
-    if maximizingPlayer:
-        maxEval = -np.inf
-        for playerMove in validMoves: #for each child of position
+    '''
+    Sort the moves so the ones most likely to cause a cutoff come first: the hash move, then captures (and promotions)
+    by MVV-LVA (most valuable victim, least valuable attacker), then the killer moves of this ply, then the other quiet
+    moves by history score
+    '''
+    def orderMoves(self, moves, ply, hashMoveID):
+        if RANDOM_TIEBREAK:
+            random.shuffle(moves) #the sort is stable, so this only changes the order of equally scored moves
+        killers = self.killerMoves[ply] if ply < MAX_PLY else (None, None)
+        historyScores = self.historyScores
+
+        def moveScore(move):
+            if move.moveID == hashMoveID:
+                return HASH_MOVE_SCORE
+            if move.isCapture or move.isPawnPromotion:
+                return CAPTURE_SCORE + getCaptureOrder(move) #MVV-LVA, as in the staged generation below the root
+            if move.moveID == killers[0]:
+                return KILLER_SCORES[0]
+            if move.moveID == killers[1]:
+                return KILLER_SCORES[1]
+            return min(historyScores.get((move.pieceMoved, move.endRow * 8 + move.endCol), 0), MAX_HISTORY_SCORE)
+
+        moves.sort(key=moveScore, reverse=True)
+
+
+    '''
+    The moves of a node in search order: validMoves sorted by orderMoves at the root, generated in stages below it.
+    The time spent generating them goes to the search statistics
+    '''
+    def getOrderedMoves(self, gs, validMoves, ply, hashMoveID):
+        if validMoves is not None:
+            start = time.perf_counter()
+            self.orderMoves(validMoves, ply, hashMoveID)
+            self.searchStats.generationTime += time.perf_counter() - start
+            return validMoves
+        killers = self.killerMoves[ply] if ply < MAX_PLY else ()
+        moveBuffer = self.moveBuffers[ply] if ply < MAX_PLY else None
+        return self.timeGeneration(gs.iterStagedMoves(hashMoveID, killers, self.historyScores, shuffle=RANDOM_TIEBREAK,
+                                                      moveBuffer=moveBuffer))
+
+
+    '''
+    Yield the moves of a move generator, adding the time it takes to produce them to the search statistics
+    '''
+    def timeGeneration(self, moves):
+        searchStats = self.searchStats
+        while True:
+            start = time.perf_counter()
+            move = next(moves, None)
+            searchStats.generationTime += time.perf_counter() - start
+            if move is None:
+                return
+            yield move
+
+
+    def recordCutoff(self, moveIndex):
+        self.searchStats.cutoffs += 1
+        if moveIndex == 0:
+            self.searchStats.firstMoveCutoffs += 1
+
+
+    '''
+    Remember a quiet move that caused a beta cutoff, as a killer move for this ply and in the history scores
+    '''
+    def updateOrderingTables(self, move, ply, depth):
+        if move.isCapture or move.isPawnPromotion:
+            return
+        if ply < MAX_PLY:
+            killers = self.killerMoves[ply]
+            if killers[0] != move.moveID:
+                killers[1] = killers[0]
+                killers[0] = move.moveID
+        historyKey = (move.pieceMoved, move.endRow * 8 + move.endCol)
+        self.historyScores[historyKey] = self.historyScores.get(historyKey, 0) + depth * depth
+
+
+    '''
+    Minimax algorithm. validMoves are the moves of the root; below the root (validMoves None) the moves are generated in
+    stages by gs.iterStagedMoves, so a cutoff saves the generation of the moves that were not tried. ply is the distance
+    from the root
+    '''
+    def minimax(self, gs, validMoves, depth, alpha, beta, maximizingPlayer, ply=0):
+        if ply != 0 and gs.isDraw(1): #repeating a position once is enough to claim the draw later
+            self.nodesSearched += 1
+            return DRAW
+        if ply != 0 and self.tablebase is not None and gs.pieceCount <= self.tablebase.maxPieces:
+            tablebaseScore = self.probeTablebase(gs, ply)
+            if tablebaseScore is not None:
+                self.nodesSearched += 1
+                return tablebaseScore if gs.whiteToMove else -tablebaseScore
+        if depth == 0:
+            if QUIESCENCE:
+                return self.quiescence(gs, alpha, beta, maximizingPlayer, ply)
+            self.nodesSearched += 1
+            self.checkLimits()
+            return self.evaluate(gs)
+        self.nodesSearched += 1
+        self.checkLimits()
+
+        #transposition table lookup. No cutoffs at the root, where the move itself is needed
+        alphaOrig, betaOrig = alpha, beta
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        hashMoveID = entry[3] if entry is not None else None
+        if entry is not None and ply != 0 and entry[0] >= depth:
+            entryScore, entryFlag = fromTableScore(entry[1], ply), entry[2]
+            if entryFlag == EXACT:
+                return entryScore
+            elif entryFlag == LOWERBOUND:
+                alpha = max(alpha, entryScore)
+            else:
+                beta = min(beta, entryScore)
+            if beta <= alpha:
+                return entryScore
+
+        moves = self.getOrderedMoves(gs, validMoves, ply, hashMoveID)
+        self.searchStats.expandedNodes += 1
+        bestMove = None
+        if maximizingPlayer:
+            maxEval = -np.inf
+            for moveIndex, playerMove in enumerate(moves): #for each child of position
+                gs.makeMove(playerMove)
+                evaluation = self.minimax(gs, None, depth - 1, alpha, beta, False, ply + 1)
+                alpha = max(alpha, evaluation)
+                if evaluation > maxEval:
+                    maxEval = evaluation
+                    bestMove = playerMove
+                    if ply == 0:
+                        self.rootMove = playerMove
+                gs.undoMove()
+                if beta <= alpha:
+                    self.recordCutoff(moveIndex)
+                    self.updateOrderingTables(playerMove, ply, depth)
+                    break
+            if bestMove is None: #no legal move
+                maxEval = -getMateScore(gs, ply)
+            self.storeResult(gs, depth, ply, maxEval, alphaOrig, betaOrig, bestMove)
+            return maxEval
+        else:
+            minEval = +np.inf
+            for moveIndex, playerMove in enumerate(moves): #for each child of position
+                gs.makeMove(playerMove)
+                evaluation = self.minimax(gs, None, depth - 1, alpha, beta, True, ply + 1)
+                beta = min(beta, evaluation)
+                if evaluation < minEval:
+                    minEval = evaluation
+                    bestMove = playerMove
+                    if ply == 0:
+                        self.rootMove = playerMove
+                gs.undoMove()
+                if beta <= alpha:
+                    self.recordCutoff(moveIndex)
+                    self.updateOrderingTables(playerMove, ply, depth)
+                    break
+            if bestMove is None:
+                minEval = getMateScore(gs, ply)
+            self.storeResult(gs, depth, ply, minEval, alphaOrig, betaOrig, bestMove)
+            return minEval
+
+
+    '''
+    Search the root with a window around the score of the previous iteration, widening it each time the score falls
+    outside, until it is found. color is 1 if white is to move, -1 otherwise. Returns the score from white's point of view
+    '''
+    def aspirationSearch(self, gs, validMoves, depth, color):
+        if depth == 1 or self.searchScore is None or np.isinf(self.searchScore):
+            return color * self.pvs(gs, validMoves, depth, -np.inf, np.inf, color)
+        delta = ASPIRATION_WINDOW
+        expected = color * self.searchScore
+        alpha, beta = expected - delta, expected + delta
+        while True:
+            value = self.pvs(gs, validMoves, depth, alpha, beta, color)
+            #done when the score is inside the window, or outside it on a side that is already open
+            if alpha < value < beta or (value >= beta == np.inf) or (value <= alpha == -np.inf):
+                return color * value
+            delta *= 4 #after two failures on the same side the window is open on that side
+            if value <= alpha:
+                alpha = expected - delta if delta <= 4 * ASPIRATION_WINDOW else -np.inf
+            else:
+                beta = expected + delta if delta <= 4 * ASPIRATION_WINDOW else np.inf
+
+
+    '''
+    Negamax principal variation search: the scores are from the point of view of the side to move (color 1 for white,
+    -1 for black). The first move is searched with the full window; the others only with a null window to prove they
+    are not better, and again with the full window when they are. validMoves and ply as in minimax.
+    The transposition table and the quiescence search are shared with minimax and keep white's point of view
+    '''
+    def pvs(self, gs, validMoves, depth, alpha, beta, color, ply=0):
+        if ply != 0 and gs.isDraw(1):
+            self.nodesSearched += 1
+            return DRAW
+        if ply != 0 and self.tablebase is not None and gs.pieceCount <= self.tablebase.maxPieces:
+            tablebaseScore = self.probeTablebase(gs, ply)
+            if tablebaseScore is not None:
+                self.nodesSearched += 1
+                return tablebaseScore
+        if depth == 0:
+            if QUIESCENCE:
+                return color * self.quiescence(gs, *toWhiteWindow(alpha, beta, color), color == 1, ply)
+            self.nodesSearched += 1
+            self.checkLimits()
+            return color * self.evaluate(gs)
+        self.nodesSearched += 1
+        self.checkLimits()
+
+        #transposition table lookup. No cutoffs at the root, where the move itself is needed
+        alphaOrig, betaOrig = alpha, beta
+        isRoot = ply == 0
+        entry = self.transpositionTable.probe(gs.zobristKey)
+        hashMoveID = entry[3] if entry is not None else None
+        if entry is not None and not isRoot and entry[0] >= depth:
+            entryScore, entryFlag = color * fromTableScore(entry[1], ply), entry[2]
+            if color == -1 and entryFlag != EXACT: #a bound for white is the opposite bound for black
+                entryFlag = UPPERBOUND if entryFlag == LOWERBOUND else LOWERBOUND
+            if entryFlag == EXACT:
+                return entryScore
+            elif entryFlag == LOWERBOUND:
+                alpha = max(alpha, entryScore)
+            else:
+                beta = min(beta, entryScore)
+            if beta <= alpha:
+                return entryScore
+
+        inCheck = False
+        if not isRoot and (NULL_MOVE_PRUNING or LATE_MOVE_REDUCTIONS or FUTILITY_PRUNING):
+            inCheck = gs.isKingInCheck()
+
+        #null-move pruning, not twice in a row and not in pawn endgames where passing could be the best move (zugzwang)
+        if NULL_MOVE_PRUNING and not isRoot and not inCheck and depth >= NULL_MOVE_MIN_DEPTH and beta != np.inf and \
+                gs.moveLog and gs.moveLog[-1] is not None and gs.hasNonPawnMaterial(gs.whiteToMove):
+            gs.makeNullMove()
+            evaluation = -self.pvs(gs, None, max(0, depth - 1 - NULL_MOVE_REDUCTION), -beta, -beta + PVS_EPSILON,
+                                   -color, ply + 1)
+            gs.undoMove()
+            if evaluation >= beta:
+                return beta
+
+        #futility pruning: the quiet moves can't bring the static evaluation up to alpha
+        futile = False
+        if FUTILITY_PRUNING and not isRoot and not inCheck and depth < len(FUTILITY_MARGINS):
+            futilityValue = color * self.evaluate(gs) + FUTILITY_MARGINS[depth]
+            futile = futilityValue <= alpha
+
+        moves = self.getOrderedMoves(gs, validMoves, ply, hashMoveID)
+        self.searchStats.expandedNodes += 1
+        killers = self.killerMoves[ply] if ply < MAX_PLY else ()
+        bestValue = -np.inf
+        bestMove = None
+        for moveIndex, playerMove in enumerate(moves):
+            quiet = not (playerMove.isCapture or playerMove.isPawnPromotion)
+            lateMove = LATE_MOVE_REDUCTIONS and not inCheck and depth >= LMR_MIN_DEPTH and moveIndex >= LMR_MIN_MOVES
             gs.makeMove(playerMove)
-            opponentsMoves = gs.getValidMoves()
-            random.shuffle(opponentsMoves)
-            evaluation = minimax(gs, opponentsMoves, depth - 1,alpha, beta, False)
-            alpha = max(alpha, evaluation)
-            if evaluation > maxEval:
-                maxEval = evaluation
-                if depth == DEPTH:
-                    nextMove = playerMove
+            #only the quiet moves after the first one are pruned or reduced, never the killers nor the checks
+            reducible = quiet and bestMove is not None and (futile or lateMove) and playerMove.moveID not in killers \
+                and not gs.isKingInCheck()
+            if futile and reducible:
+                gs.undoMove()
+                bestValue = max(bestValue, futilityValue) #what the move could at most score, for a sound bound
+                continue
+            if bestMove is None:
+                evaluation = -self.pvs(gs, None, depth - 1, -beta, -alpha, -color, ply + 1)
+            else:
+                reduction = 1 if lateMove and reducible else 0
+                evaluation = -self.pvs(gs, None, depth - 1 - reduction, -alpha - PVS_EPSILON, -alpha, -color, ply + 1)
+                if reduction and evaluation > alpha: #the reduced search was wrong, search at full depth
+                    evaluation = -self.pvs(gs, None, depth - 1, -alpha - PVS_EPSILON, -alpha, -color, ply + 1)
+                if alpha < evaluation < beta: #better than the principal variation, get its exact score
+                    evaluation = -self.pvs(gs, None, depth - 1, -beta, -alpha, -color, ply + 1)
             gs.undoMove()
+            if evaluation > bestValue or bestMove is None:
+                bestValue = evaluation
+                bestMove = playerMove
+                if isRoot:
+                    self.rootMove = playerMove
+            alpha = max(alpha, evaluation)
             if beta <= alpha:
+                self.recordCutoff(moveIndex)
+                self.updateOrderingTables(playerMove, ply, depth)
                 break
-            
-        return maxEval
-    else:
-        minEval = +np.inf
-        for playerMove in validMoves: #for each child of position
-            gs.makeMove(playerMove)
-            opponentsMoves = gs.getValidMoves()
-            random.shuffle(opponentsMoves)
-            evaluation = minimax(gs, opponentsMoves, depth - 1, alpha, beta, True)
-            beta = min(beta, evaluation)
-            if evaluation < minEval:
-                minEval = evaluation
-                if depth == DEPTH:
-                    nextMove = playerMove
+        if bestMove is None: #no legal move
+            bestValue = -getMateScore(gs, ply)
+        self.storeResult(gs, depth, ply, color * bestValue, *toWhiteWindow(alphaOrig, betaOrig, color), bestMove)
+        return bestValue
+
+
+    '''
+    Score of the position of gs from the tablebases, for the side to move, or None if it is not in the tables. A win
+    found closer to the root scores higher, so the search heads for it. Cursed wins and blessed losses are draws
+    '''
+    def probeTablebase(self, gs, ply):
+        wdl = self.tablebase.probeWDL(gs)
+        if wdl is None:
+            return None
+        if wdl == WIN:
+            return TABLEBASE_WIN - ply
+        if wdl == LOSS:
+            return -TABLEBASE_WIN + ply
+        return DRAW
+
+
+    '''
+    Quiescence search: from a leaf of minimax, keep searching the captures and promotions until the position is quiet.
+    The side to move may also stand pat (take the static evaluation) instead of capturing, since it is never forced
+    to. When in check there is no standing pat and every evasion is searched. ply is the distance from the root
+    '''
+    def quiescence(self, gs, alpha, beta, maximizingPlayer, ply):
+        self.nodesSearched += 1
+        self.quiescenceNodes += 1
+        self.checkLimits()
+        start = time.perf_counter()
+        checkInfo = gs.getCheckInfo()
+        inCheck = gs.inCheck #read it now, the searches below overwrite it
+        moves = gs.generateMoves(checkInfo, True, inCheck) #every evasion when in check, captures first
+        moves.sort(key=getCaptureOrder, reverse=True)
+        self.searchStats.generationTime += time.perf_counter() - start
+        if inCheck:
+            mateScore = getMateScore(gs, ply, True) #mated unless an evasion is found
+            standPat = -mateScore if maximizingPlayer else mateScore
+        else:
+            standPat = self.evaluate(gs)
+            if maximizingPlayer:
+                if standPat >= beta:
+                    return standPat
+                alpha = max(alpha, standPat)
+            else:
+                if standPat <= alpha:
+                    return standPat
+                beta = min(beta, standPat)
+
+        bestEval = standPat
+        self.searchStats.expandedNodes += 1
+        for moveIndex, move in enumerate(moves):
+            #delta pruning: even winning the captured piece with a margin would not reach the bound
+            if not inCheck and not move.isPawnPromotion:
+                gain = pieceScores[move.pieceCaptured[1]] + DELTA_MARGIN
+                if (maximizingPlayer and standPat + gain <= alpha) or (not maximizingPlayer and standPat - gain >= beta):
+                    continue
+            gs.makeMove(move)
+            evaluation = self.quiescence(gs, alpha, beta, not maximizingPlayer, ply + 1)
             gs.undoMove()
+            if maximizingPlayer:
+                bestEval = max(bestEval, evaluation)
+                alpha = max(alpha, evaluation)
+            else:
+                bestEval = min(bestEval, evaluation)
+                beta = min(beta, evaluation)
             if beta <= alpha:
+                self.recordCutoff(moveIndex)
                 break
-            
-        return minEval
+        return bestEval
+
+
+    '''
+    Store a search result in the transposition table. The score is exact only if it fell inside the original window.
+    ply is the distance from the root, see toTableScore
+    '''
+    def storeResult(self, gs, depth, ply, value, alphaOrig, betaOrig, bestMove):
+        if value <= alphaOrig:
+            flag = UPPERBOUND
+        elif value >= betaOrig:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        self.transpositionTable.store(gs.zobristKey, depth, toTableScore(value, ply), flag,
+                                      bestMove.moveID if bestMove is not None else None)
+
+
+    '''
+    evaluate, with the time it takes added to the search statistics
+    '''
+    def evaluate(self, gs):
+        start = time.perf_counter()
+        value = evaluate(gs)
+        self.searchStats.evaluationTime += time.perf_counter() - start
+        return value
+
+
+'''
+Score of a position without legal moves for the side that is not to move: CHECKMATE less the distance from the root if
+the side to move is in check (a mate found sooner scores higher), STALEMATE otherwise. inCheck skips the check test
+'''
+def getMateScore(gs, ply, inCheck=None):
+    if inCheck is None:
+        inCheck = gs.isKingInCheck()
+    return CHECKMATE - ply if inCheck else STALEMATE
+
+
+'''
+Score of a search ply plies from the root, as stored in the transposition table. Mate and tablebase scores count the
+distance from the root, which is not the same when the position comes up again at another ply, so they are stored
+counting the distance from the position itself: the ply is added to a winning score and taken from a losing one
+'''
+def toTableScore(score, ply):
+    if score >= TABLEBASE_WIN - MAX_PLY:
+        return score + ply
+    if score <= -TABLEBASE_WIN + MAX_PLY:
+        return score - ply
+    return score
 
 
+'''
+Score of the transposition table, as seen by a search ply plies from the root, see toTableScore
+'''
+def fromTableScore(score, ply):
+    if score >= TABLEBASE_WIN - MAX_PLY:
+        return score - ply
+    if score <= -TABLEBASE_WIN + MAX_PLY:
+        return score + ply
+    return score
+
+
+'''
+The (alpha, beta) window of the side to move seen from white's point of view
+'''
+def toWhiteWindow(alpha, beta, color):
+    return (alpha, beta) if color == 1 else (-beta, -alpha)
+
+
+'''
+Evaluate the position, from the incremental totals kept by the game state if it has them
+'''
+def evaluate(gs):
+    if gs.positionTable is None:
+        return score(gs)
+    value = gs.materialScore + POSITION_WEIGHT * gs.positionScore
+    if CHECK_INCREMENTAL_EVAL:
+        fullScore = score(gs)
+        assert abs(value - fullScore) < 1e-9, "Incremental evaluation {} differs from score() {}".format(value, fullScore)
+    return value
+
 
 '''
 Score the game state based on material
@@ -187,7 +766,7 @@ Score the game state based on material
 def score(gs):
     
     score = 0
-    weight = 1./50
+    weight = POSITION_WEIGHT
     for row in range(len(gs.board)):
         for col in range(len(gs.board[row])):
             square = gs.board[row][col]
@@ -207,3 +786,37 @@ def score(gs):
     return score
 
 
+'''
+Encode boards as an (N, 64) int8 array for evaluateBatch: 0 for an empty square, 1 + the index of the piece in
+ChessEngine.PIECE_CODES otherwise
+'''
+def encodeBoards(boards):
+    return np.array([[squareCodes[square] for row in board for square in row] for board in boards], dtype=np.int8).reshape(-1, 64)
+
+
+'''
+Score N positions at once, with the same values as score(). positions is either an (N, 64) array of piece codes (see
+encodeBoards) or an (N, 12, 64) array of piece planes (1 where the piece of ChessEngine.PIECE_CODES stands).
+Returns the N scores, from white's point of view
+'''
+def evaluateBatch(positions, positionWeight=POSITION_WEIGHT):
+    positions = np.asarray(positions)
+    weights = materialWeights + positionWeight * positionWeights
+    if positions.ndim == 2 and positions.shape[1] == 64:
+        squareWeights = np.vstack((np.zeros(64), weights)) #row 0: empty square
+        return squareWeights[positions, np.arange(64)].sum(axis=1)
+    if positions.ndim == 3 and positions.shape[1:] == (12, 64):
+        return np.tensordot(positions.astype(np.float64), weights, axes=([1, 2], [0, 1]))
+    raise ValueError("Expected an (N, 64) or (N, 12, 64) array of positions, got shape {}".format(positions.shape))
+
+
+'''
+Score the position after each of the moves at once. Returns an array of scores in the order of moves
+'''
+def evaluateMoves(gs, moves):
+    boards = []
+    for move in moves:
+        gs.makeMove(move)
+        boards.append([row[:] for row in gs.board])
+        gs.undoMove()
+    return evaluateBatch(encodeBoards(boards))
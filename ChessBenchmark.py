@@ -0,0 +1,145 @@
+"""
+Search benchmark: runs the AI search to a fixed depth on a set of positions and prints the node counts and the
+time to depth, to compare search algorithms (ChessAI.SEARCH_ALGORITHMS) and settings.
+
+Usage:
+    python ChessBenchmark.py [--depth 4] [--algorithm pvs] [--backend legacy] [--disable null-move lmr futility]
+                             [--json] [--profile cprofile|tracemalloc]
+    python ChessBenchmark.py --snapshot [--plies 200] [--backend legacy]
+Without --algorithm every algorithm is run. --disable turns off selective search features of pvs, to measure what
+each one gains (nodes, time) and whether it changes the moves found. The transposition table and the move ordering
+tables are cleared before each position and the random tie-break is turned off, so runs are repeatable.
+--json prints the statistics of each search as a JSON line instead (see ChessSearchStats), --profile prints a profile
+of each search.
+--snapshot compares the size and time of sending a game state to a search process as a snapshot
+(GameState.snapshot, fromSnapshot) or pickled, over a long game.
+"""
+
+import argparse
+import pickle
+import random
+import sys
+import time
+
+import json
+
+import ChessAI
+import ChessEngine
+import ChessSearchStats
+from ChessPerft import BACKENDS
+
+#selective search features that can be turned off, by the name of their ChessAI flag
+FEATURE_FLAGS = {
+    'null-move': 'NULL_MOVE_PRUNING',
+    'lmr': 'LATE_MOVE_REDUCTIONS',
+    'futility': 'FUTILITY_PRUNING'
+}
+
+BENCHMARK_POSITIONS = [
+    ("Start position", ChessEngine.START_FEN),
+    ("Italian game", "r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1"),
+    ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"),
+    ("Rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+    ("Black to move", "r1bq1rk1/pp2ppbp/2np1np1/8/3NP3/2N1BP2/PPPQ2PP/R3KB1R b KQ - 3 9"),
+]
+
+
+'''
+Search every benchmark position to the given depth. Returns (total nodes, total time)
+'''
+def runBenchmark(depth, algorithm, backend='bitboard', jsonLines=False, profiler=None):
+    ChessAI.RANDOM_TIEBREAK = False
+    searcher = ChessAI.Searcher(algorithm)
+    totalNodes = 0
+    totalTime = 0.
+    if not jsonLines:
+        print("{}, depth {}".format(algorithm, depth))
+    for name, fen in BENCHMARK_POSITIONS:
+        gs = BACKENDS[backend](fen)
+        searcher.transpositionTable.clear()
+        start = time.time()
+        move = searcher.searchBestMove(gs, gs.getValidMoves(), depth, profiler=profiler)
+        elapsed = time.time() - start
+        totalNodes += searcher.nodesSearched
+        totalTime += elapsed
+        if jsonLines:
+            stats = searcher.searchStats.toDict()
+            stats.update({"position": name, "algorithm": algorithm, "move": move.getChessNotation()})
+            print(json.dumps(stats))
+            continue
+        print("  {:16} {:8} score {:7.2f}  nodes {:8} (quiescence {:8})  {:.2f}s".format(
+            name, str(move), searcher.searchScore, searcher.nodesSearched, searcher.quiescenceNodes, elapsed))
+    if not jsonLines:
+        print("  Total nodes: {}  Time: {:.2f}s  NPS: {:.0f}".format(
+            totalNodes, totalTime, totalNodes / totalTime if totalTime > 0 else 0))
+    return totalNodes, totalTime
+
+
+'''
+Play a game of random moves (fixed seed) up to plies half moves, and measure at every ply the size of the game state
+pickled and of its snapshot, and the time to create and to load each. Returns the averages as a dict
+'''
+def runSnapshotBenchmark(plies=200, backend='bitboard'):
+    rng = random.Random(0)
+    gs = BACKENDS[backend]()
+    totals = {"pickleBytes": 0, "pickleTime": 0., "unpickleTime": 0.,
+              "snapshotBytes": 0, "snapshotTime": 0., "fromSnapshotTime": 0.}
+    measured = 0
+    for ply in range(plies):
+        validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            break
+        gs.makeMove(rng.choice(validMoves))
+        start = time.perf_counter()
+        data = pickle.dumps(gs)
+        middle = time.perf_counter()
+        pickle.loads(data)
+        end = time.perf_counter()
+        totals["pickleBytes"] += len(data)
+        totals["pickleTime"] += middle - start
+        totals["unpickleTime"] += end - middle
+        start = time.perf_counter()
+        snapshot = gs.snapshot()
+        middle = time.perf_counter()
+        type(gs).fromSnapshot(snapshot)
+        end = time.perf_counter()
+        totals["snapshotBytes"] += len(snapshot)
+        totals["snapshotTime"] += middle - start
+        totals["fromSnapshotTime"] += end - middle
+        measured += 1
+    averages = {name: total / measured for name, total in totals.items()}
+    print("{} plies, averages per ply ({})".format(measured, backend))
+    print("  pickle:   {:8.0f} bytes  dump {:7.1f}us  load {:7.1f}us".format(
+        averages["pickleBytes"], 1e6 * averages["pickleTime"], 1e6 * averages["unpickleTime"]))
+    print("  snapshot: {:8.0f} bytes  dump {:7.1f}us  load {:7.1f}us".format(
+        averages["snapshotBytes"], 1e6 * averages["snapshotTime"], 1e6 * averages["fromSnapshotTime"]))
+    print("  last ply: pickle {} bytes, snapshot {} bytes".format(len(data), len(snapshot)))
+    return averages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI search benchmark")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--algorithm", choices=ChessAI.SEARCH_ALGORITHMS, help="default: all of them")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default='bitboard')
+    parser.add_argument("--disable", nargs='*', choices=sorted(FEATURE_FLAGS), default=[],
+                        help="selective search features to turn off")
+    parser.add_argument("--json", action="store_true", help="print the statistics of each search as JSON lines")
+    parser.add_argument("--profile", choices=ChessSearchStats.PROFILERS, help="profile each search")
+    parser.add_argument("--snapshot", action="store_true", help="compare game state snapshots with pickling instead")
+    parser.add_argument("--plies", type=int, default=200, help="length of the game of --snapshot")
+    args = parser.parse_args()
+    if args.snapshot:
+        runSnapshotBenchmark(args.plies, args.backend)
+        return 0
+    for feature in args.disable:
+        setattr(ChessAI, FEATURE_FLAGS[feature], False)
+    for algorithm in [args.algorithm] if args.algorithm else ChessAI.SEARCH_ALGORITHMS:
+        runBenchmark(args.depth, algorithm, args.backend, args.json, args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
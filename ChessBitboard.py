@@ -0,0 +1,547 @@
+"""
+Bitboard backend for the game state. Keeps twelve 64-bit piece bitboards plus occupancy masks next to the 8x8 board
+and uses them (together with precomputed attack tables) to generate legal moves much faster than the square by square
+generator in ChessEngine. It has the same makeMove/undoMove/getValidMoves interface, so it can be used anywhere a
+ChessEngine.GameState is expected.
+
+Squares are numbered 0..63 as row*8 + col, with row 0 being the 8th rank, so they match the (row, col) coordinates
+used by the board and by ChessEngine.Move.
+"""
+
+import ChessEngine
+from ChessEngine import Move
+
+PIECES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WHITE = 0
+BLACK = 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+FULL_BOARD = (1 << 64) - 1
+SQUARE_BB = [1 << sq for sq in range(64)]
+SQUARES = [divmod(sq, 8) for sq in range(64)]
+ROW_MASKS = [0xFF << (8 * r) for r in range(8)]
+FILE_A = sum(SQUARE_BB[r * 8] for r in range(8))
+FILE_H = FILE_A << 7
+PROMOTION_ROWS = ROW_MASKS[0] | ROW_MASKS[7]
+
+
+def _onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def _leaperAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if _onBoard(r + dr, c + dc):
+                bb |= SQUARE_BB[(r + dr) * 8 + dc + c]
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _leaperAttacks([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _leaperAttacks([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+#PAWN_ATTACKS[color][sq] are the squares attacked by a pawn of that color standing on sq
+PAWN_ATTACKS = [_leaperAttacks([(-1, -1), (-1, 1)]), _leaperAttacks([(1, -1), (1, 1)])]
+
+#Ray directions. The first four increase the square index (so the nearest blocker is the lowest bit),
+#the last four decrease it (so the nearest blocker is the highest bit)
+ROOK_DIRECTIONS_POS = [(1, 0), (0, 1)]
+ROOK_DIRECTIONS_NEG = [(-1, 0), (0, -1)]
+BISHOP_DIRECTIONS_POS = [(1, 1), (1, -1)]
+BISHOP_DIRECTIONS_NEG = [(-1, -1), (-1, 1)]
+
+
+def _rays(directions):
+    table = []
+    for d in directions:
+        rays = []
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            bb = 0
+            r, c = r + d[0], c + d[1]
+            while _onBoard(r, c):
+                bb |= SQUARE_BB[r * 8 + c]
+                r, c = r + d[0], c + d[1]
+            rays.append(bb)
+        table.append(rays)
+    return table
+
+
+ROOK_RAYS_POS = _rays(ROOK_DIRECTIONS_POS)
+ROOK_RAYS_NEG = _rays(ROOK_DIRECTIONS_NEG)
+BISHOP_RAYS_POS = _rays(BISHOP_DIRECTIONS_POS)
+BISHOP_RAYS_NEG = _rays(BISHOP_DIRECTIONS_NEG)
+ROOK_RAYS = [ROOK_RAYS_POS[0][sq] | ROOK_RAYS_POS[1][sq] | ROOK_RAYS_NEG[0][sq] | ROOK_RAYS_NEG[1][sq]
+             for sq in range(64)]
+BISHOP_RAYS = [BISHOP_RAYS_POS[0][sq] | BISHOP_RAYS_POS[1][sq] | BISHOP_RAYS_NEG[0][sq] | BISHOP_RAYS_NEG[1][sq]
+               for sq in range(64)]
+
+
+def _between():
+    #BETWEEN[a][b] holds the squares strictly between a and b when they share a line, 0 otherwise
+    table = [[0] * 64 for _ in range(64)]
+    for a in range(64):
+        ra, ca = divmod(a, 8)
+        for d in ROOK_DIRECTIONS_POS + ROOK_DIRECTIONS_NEG + BISHOP_DIRECTIONS_POS + BISHOP_DIRECTIONS_NEG:
+            bb = 0
+            r, c = ra + d[0], ca + d[1]
+            while _onBoard(r, c):
+                table[a][r * 8 + c] = bb
+                bb |= SQUARE_BB[r * 8 + c]
+                r, c = r + d[0], c + d[1]
+    return table
+
+
+BETWEEN = _between()
+
+
+def rookAttacks(sq, occ):
+    attacks = 0
+    for rays in ROOK_RAYS_POS:
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in ROOK_RAYS_NEG:
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def bishopAttacks(sq, occ):
+    attacks = 0
+    for rays in BISHOP_RAYS_POS:
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in BISHOP_RAYS_NEG:
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+class BitboardGameState(ChessEngine.GameState):
+
+    def __init__(self, fen=None):
+        super().__init__(fen)
+        self.initBitboards()
+
+
+    def loadFen(self, fen):
+        super().loadFen(fen)
+        self.initBitboards()
+
+
+    '''
+    Build the piece bitboards and occupancy masks from the 8x8 board
+    '''
+    def initBitboards(self):
+        self.pieceBitboards = [0] * 12
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.pieceBitboards[PIECE_INDEX[piece]] |= SQUARE_BB[r * 8 + c]
+        self.colorOccupancy = [0, 0]
+        for i in range(6):
+            self.colorOccupancy[WHITE] |= self.pieceBitboards[i]
+            self.colorOccupancy[BLACK] |= self.pieceBitboards[i + 6]
+        self.occupancy = self.colorOccupancy[WHITE] | self.colorOccupancy[BLACK]
+
+
+    def togglePiece(self, piece, sq):
+        bb = SQUARE_BB[sq]
+        self.pieceBitboards[PIECE_INDEX[piece]] ^= bb
+        self.colorOccupancy[WHITE if piece[0] == 'w' else BLACK] ^= bb
+        self.occupancy ^= bb
+
+
+    '''
+    Toggle every bit touched by a move. XOR is its own inverse, so the same call applies and reverts the move.
+    pieceLanded is the piece standing on the end square after the move (differs from pieceMoved on promotions)
+    '''
+    def toggleMove(self, move, pieceLanded):
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        self.togglePiece(move.pieceMoved, startSq)
+        self.togglePiece(pieceLanded, endSq)
+        if move.isEnpassantMove:
+            self.togglePiece(move.pieceCaptured, move.startRow * 8 + move.endCol)
+        elif move.pieceCaptured != '--':
+            self.togglePiece(move.pieceCaptured, endSq)
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + 'R'
+            if move.endCol - move.startCol == 2: #kingside castle
+                self.togglePiece(rook, endSq + 1)
+                self.togglePiece(rook, endSq - 1)
+            else:
+                self.togglePiece(rook, endSq - 2)
+                self.togglePiece(rook, endSq + 1)
+
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.toggleMove(move, self.board[move.endRow][move.endCol])
+
+
+    def undoMove(self):
+        if len(self.moveLog) != 0 and self.moveLog[-1] is None: #null move, the pieces didn't move
+            super().undoMove()
+        elif len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            pieceLanded = self.board[move.endRow][move.endCol]
+            super().undoMove()
+            self.toggleMove(move, pieceLanded)
+
+
+    def isKingInCheck(self):
+        us = WHITE if self.whiteToMove else BLACK
+        kingSq = self.pieceBitboards[6 * us + KING].bit_length() - 1
+        return self.attackersTo(kingSq, self.occupancy, 1 - us) != 0
+
+
+    def hasNonPawnMaterial(self, white):
+        base = 6 * (WHITE if white else BLACK)
+        bbs = self.pieceBitboards
+        return (bbs[base + KNIGHT] | bbs[base + BISHOP] | bbs[base + ROOK] | bbs[base + QUEEN]) != 0
+
+
+    '''
+    Bitboard of the pieces of color byColor attacking sq, given the occupancy occ
+    '''
+    def attackersTo(self, sq, occ, byColor):
+        bbs = self.pieceBitboards
+        base = 6 * byColor
+        queens = bbs[base + QUEEN]
+        return (KNIGHT_ATTACKS[sq] & bbs[base + KNIGHT]) | \
+               (KING_ATTACKS[sq] & bbs[base + KING]) | \
+               (PAWN_ATTACKS[1 - byColor][sq] & bbs[base + PAWN]) | \
+               (rookAttacks(sq, occ) & (bbs[base + ROOK] | queens)) | \
+               (bishopAttacks(sq, occ) & (bbs[base + BISHOP] | queens))
+
+
+    '''
+    Bitboard of every square attacked by the pieces of color byColor, given the occupancy occ
+    '''
+    def attackedSquares(self, occ, byColor):
+        bbs = self.pieceBitboards
+        base = 6 * byColor
+        pawns = bbs[base + PAWN]
+        if byColor == WHITE:
+            attacks = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            attacks = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL_BOARD
+        attacks |= KING_ATTACKS[bbs[base + KING].bit_length() - 1]
+        for pieceType, attackFunction in ((KNIGHT, None), (BISHOP, bishopAttacks), (ROOK, rookAttacks),
+                                          (QUEEN, None)):
+            pieces = bbs[base + pieceType]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                sq = lsb.bit_length() - 1
+                if pieceType == KNIGHT:
+                    attacks |= KNIGHT_ATTACKS[sq]
+                elif pieceType == QUEEN:
+                    attacks |= rookAttacks(sq, occ) | bishopAttacks(sq, occ)
+                else:
+                    attacks |= attackFunction(sq, occ)
+        return attacks
+
+
+    '''
+    Pinned pieces of color us, as a dict square -> mask of the squares the piece can still move to
+    '''
+    def getPinMasks(self, kingSq, us):
+        them = 1 - us
+        bbs = self.pieceBitboards
+        base = 6 * them
+        queens = bbs[base + QUEEN]
+        snipers = (ROOK_RAYS[kingSq] & (bbs[base + ROOK] | queens)) | \
+                  (BISHOP_RAYS[kingSq] & (bbs[base + BISHOP] | queens))
+        pinMasks = {}
+        between = BETWEEN[kingSq]
+        while snipers:
+            lsb = snipers & -snipers
+            snipers ^= lsb
+            sniperSq = lsb.bit_length() - 1
+            blockers = between[sniperSq] & self.occupancy
+            if blockers and not (blockers & (blockers - 1)) and (blockers & self.colorOccupancy[us]):
+                pinMasks[blockers.bit_length() - 1] = between[sniperSq] | lsb
+        return pinMasks
+
+
+    '''
+    All moves considering checks, generated from the bitboards
+    '''
+    def getValidMoves(self):
+        moves = self.generateMoves(self.getCheckInfo(), True, True)
+        self.setEndState(moves)
+        return moves
+
+
+    '''
+    What the generator needs to know about checks and pins in the current position: (us, king square, checkers,
+    squares attacked by the opponent with the king removed, evasion mask, pin masks). Sets self.inCheck and
+    self.attackMap (see GameState.getAttackMap)
+    '''
+    def getCheckInfo(self):
+        us = WHITE if self.whiteToMove else BLACK
+        them = 1 - us
+        kingBB = self.pieceBitboards[6 * us + KING]
+        kingSq = kingBB.bit_length() - 1
+        checkers = self.attackersTo(kingSq, self.occupancy, them)
+        self.inCheck = checkers != 0
+        #checked against the occupancy without the king so it can't hide behind itself
+        attacked = self.attackedSquares(self.occupancy ^ kingBB, them)
+        self.attackMap = attacked
+        if checkers:
+            evasionMask = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+        else:
+            evasionMask = FULL_BOARD
+        return us, kingSq, checkers, attacked, evasionMask, self.getPinMasks(kingSq, us)
+
+
+    '''
+    Legal captures and promotions if captures, the other legal moves if quiets, see GameState.generateMoves
+    '''
+    def generateMoves(self, checkInfo, captures, quiets, moves=None):
+        us, kingSq, checkers, attacked, evasionMask, pinMasks = checkInfo
+        if moves is None:
+            moves = []
+        bbs = self.pieceBitboards
+        base = 6 * us
+        ownOcc = self.colorOccupancy[us]
+        enemyOcc = self.colorOccupancy[1 - us]
+        occ = self.occupancy
+        targetMask = (enemyOcc if captures else 0) | (~occ & FULL_BOARD if quiets else 0)
+
+        self.addMoves(kingSq, KING_ATTACKS[kingSq] & targetMask & ~attacked, moves)
+        if checkers & (checkers - 1): #double check, king has to move
+            return moves
+        if not checkers and quiets:
+            self.getCastleMovesBB(kingSq, us, attacked, moves)
+        targetMask &= evasionMask
+
+        #knights (a pinned knight can never move)
+        pieces = bbs[base + KNIGHT]
+        while pieces:
+            lsb = pieces & -pieces
+            pieces ^= lsb
+            sq = lsb.bit_length() - 1
+            if sq in pinMasks:
+                continue
+            self.addMoves(sq, KNIGHT_ATTACKS[sq] & targetMask, moves)
+
+        #sliders
+        for pieceType, attackFunctions in ((BISHOP, (bishopAttacks,)), (ROOK, (rookAttacks,)),
+                                           (QUEEN, (rookAttacks, bishopAttacks))):
+            pieces = bbs[base + pieceType]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                sq = lsb.bit_length() - 1
+                attacks = 0
+                for attackFunction in attackFunctions:
+                    attacks |= attackFunction(sq, occ)
+                attacks &= targetMask
+                if sq in pinMasks:
+                    attacks &= pinMasks[sq]
+                self.addMoves(sq, attacks, moves)
+
+        self.getPawnMovesBB(us, occ, enemyOcc, evasionMask, pinMasks, kingSq, moves, captures, quiets)
+        return moves
+
+
+    '''
+    The move with this ID if it is legal in the current position, else None, see GameState.getLegalMove. Checked on
+    the masks of checkInfo; pawn and castle moves are looked up among the pawn or castle moves generated here
+    '''
+    def getLegalMove(self, moveID, checkInfo):
+        us, kingSq, checkers, attacked, evasionMask, pinMasks = checkInfo
+        startSq, endSq = moveID & 63, (moveID >> 6) & 63
+        startSquare = SQUARES[startSq]
+        piece = self.board[startSquare[0]][startSquare[1]]
+        if piece[0] != ('w' if us == WHITE else 'b') or self.colorOccupancy[us] & SQUARE_BB[endSq]:
+            return None
+        pieceType = piece[1]
+        doubleCheck = checkers & (checkers - 1)
+        if pieceType == 'p' or (pieceType == 'K' and abs(endSq - startSq) == 2):
+            moves = []
+            if pieceType == 'p' and not doubleCheck:
+                self.getPawnMovesBB(us, self.occupancy, self.colorOccupancy[1 - us], evasionMask, pinMasks, kingSq,
+                                    moves)
+            elif pieceType == 'K' and not checkers:
+                self.getCastleMovesBB(kingSq, us, attacked, moves)
+            for move in moves:
+                if move.moveID == moveID:
+                    return move
+            return None
+        if moveID >> 12: #only pawns promote
+            return None
+        if pieceType == 'K':
+            targets = KING_ATTACKS[startSq] & ~attacked
+        elif doubleCheck or (pieceType == 'N' and startSq in pinMasks):
+            return None
+        else:
+            occ = self.occupancy
+            if pieceType == 'N':
+                targets = KNIGHT_ATTACKS[startSq]
+            elif pieceType == 'B':
+                targets = bishopAttacks(startSq, occ)
+            elif pieceType == 'R':
+                targets = rookAttacks(startSq, occ)
+            else:
+                targets = rookAttacks(startSq, occ) | bishopAttacks(startSq, occ)
+            targets &= evasionMask
+            if startSq in pinMasks:
+                targets &= pinMasks[startSq]
+        if not targets & SQUARE_BB[endSq]:
+            return None
+        return Move(startSquare, SQUARES[endSq], self.board)
+
+
+    def addMoves(self, startSq, targets, moves):
+        startSquare = SQUARES[startSq]
+        board = self.board
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            moves.append(Move(startSquare, SQUARES[lsb.bit_length() - 1], board))
+
+
+    '''
+    Pawn moves. Captures (en-passant included) and promotions if captures, the other pushes if quiets
+    '''
+    def getPawnMovesBB(self, us, occ, enemyOcc, evasionMask, pinMasks, kingSq, moves, captures=True, quiets=True):
+        board = self.board
+        pawns = self.pieceBitboards[6 * us + PAWN]
+        pinned = 0
+        for sq in pinMasks:
+            pinned |= SQUARE_BB[sq]
+        #squares a push may go to: the last rank for promotions, the others for quiet moves
+        pushMask = (PROMOTION_ROWS if captures else 0) | (~PROMOTION_ROWS & FULL_BOARD if quiets else 0)
+        #pinned pawns one by one, restricted to their pin line
+        pinnedPawns = pawns & pinned
+        forward = -8 if us == WHITE else 8
+        startRow = 6 if us == WHITE else 1
+        while pinnedPawns:
+            lsb = pinnedPawns & -pinnedPawns
+            pinnedPawns ^= lsb
+            sq = lsb.bit_length() - 1
+            allowed = evasionMask & pinMasks[sq]
+            oneStep = sq + forward
+            if not (occ & SQUARE_BB[oneStep]):
+                if allowed & pushMask & SQUARE_BB[oneStep]:
+                    self.addPawnMove(SQUARES[sq], SQUARES[oneStep], moves)
+                twoStep = oneStep + forward
+                if quiets and SQUARES[sq][0] == startRow and not (occ & SQUARE_BB[twoStep]) and allowed & SQUARE_BB[twoStep]:
+                    moves.append(Move(SQUARES[sq], SQUARES[twoStep], board))
+            if captures:
+                targets = PAWN_ATTACKS[us][sq] & enemyOcc & allowed
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    self.addPawnMove(SQUARES[sq], SQUARES[target.bit_length() - 1], moves)
+
+        #all the other pawns at once, shifting the whole bitboard
+        pawns &= ~pinned
+        empty = ~occ
+        if us == WHITE:
+            oneStep = (pawns >> 8) & empty
+            self.addPawnMoves(oneStep & evasionMask & pushMask, 8, moves)
+            if quiets:
+                twoStep = ((oneStep & ROW_MASKS[5]) >> 8) & empty
+                self.addPawnMoves(twoStep & evasionMask, 16, moves)
+            if captures:
+                self.addPawnMoves(((pawns & ~FILE_A) >> 9) & enemyOcc & evasionMask, 9, moves)
+                self.addPawnMoves(((pawns & ~FILE_H) >> 7) & enemyOcc & evasionMask, 7, moves)
+        else:
+            oneStep = (pawns << 8) & empty & FULL_BOARD
+            self.addPawnMoves(oneStep & evasionMask & pushMask, -8, moves)
+            if quiets:
+                twoStep = ((oneStep & ROW_MASKS[2]) << 8) & empty
+                self.addPawnMoves(twoStep & evasionMask, -16, moves)
+            if captures:
+                self.addPawnMoves(((pawns & ~FILE_A) << 7) & enemyOcc & evasionMask, -7, moves)
+                self.addPawnMoves(((pawns & ~FILE_H) << 9) & enemyOcc & evasionMask, -9, moves)
+
+        if captures and self.enpassantPossible != ():
+            enpassantSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+            capturedSq = enpassantSq - forward
+            them = 1 - us
+            candidates = PAWN_ATTACKS[them][enpassantSq] & self.pieceBitboards[6 * us + PAWN]
+            while candidates:
+                lsb = candidates & -candidates
+                candidates ^= lsb
+                #en-passant removes two pawns from the same rank, so verify the king directly on the resulting occupancy
+                occAfter = occ ^ lsb ^ SQUARE_BB[enpassantSq] ^ SQUARE_BB[capturedSq]
+                self.pieceBitboards[6 * them + PAWN] ^= SQUARE_BB[capturedSq]
+                kingSafe = not self.attackersTo(kingSq, occAfter, them)
+                self.pieceBitboards[6 * them + PAWN] ^= SQUARE_BB[capturedSq]
+                if kingSafe:
+                    moves.append(Move(SQUARES[lsb.bit_length() - 1], SQUARES[enpassantSq], board, isEnpassantMove=True))
+
+
+    '''
+    Add a pawn move for every target in targets. delta is the square offset from the target back to the pawn
+    '''
+    def addPawnMoves(self, targets, delta, moves):
+        board = self.board
+        promotions = targets & PROMOTION_ROWS
+        targets ^= promotions
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            sq = lsb.bit_length() - 1
+            moves.append(Move(SQUARES[sq + delta], SQUARES[sq], board))
+        while promotions:
+            lsb = promotions & -promotions
+            promotions ^= lsb
+            sq = lsb.bit_length() - 1
+            self.addPawnMove(SQUARES[sq + delta], SQUARES[sq], moves)
+
+
+    '''
+    Castle moves. attacked holds the squares attacked by the opponent; only called when the king is not in check
+    '''
+    def getCastleMovesBB(self, kingSq, us, attacked, moves):
+        if us == WHITE:
+            kingSide = self.castlingRights & ChessEngine.WHITE_KINGSIDE
+            queenSide = self.castlingRights & ChessEngine.WHITE_QUEENSIDE
+        else:
+            kingSide = self.castlingRights & ChessEngine.BLACK_KINGSIDE
+            queenSide = self.castlingRights & ChessEngine.BLACK_QUEENSIDE
+        occ = self.occupancy
+        kingSquare = SQUARES[kingSq]
+        if kingSide:
+            path = SQUARE_BB[kingSq + 1] | SQUARE_BB[kingSq + 2]
+            if not (occ & path) and not (attacked & path):
+                moves.append(Move(kingSquare, SQUARES[kingSq + 2], self.board, isCastleMove=True))
+        if queenSide:
+            path = SQUARE_BB[kingSq - 1] | SQUARE_BB[kingSq - 2]
+            if not (occ & (path | SQUARE_BB[kingSq - 3])) and not (attacked & path):
+                moves.append(Move(kingSquare, SQUARES[kingSq - 2], self.board, isCastleMove=True))
+
+
+    def setEndState(self, moves):
+        if len(moves) == 0: #Either checkmate or stalemate
+            if self.inCheck:
+                self.checkMate = True
+            else:
+                self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
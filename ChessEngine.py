@@ -2,13 +2,68 @@
 Responsible for storing all the info about the state of a chess game. Also responsible for determining valid moves at the current states and a move log.
 """
 
+import random
 import string
+import struct
 
 from matplotlib.pyplot import pie
 
+
+'''
+Zobrist keys: one random 64-bit number per (piece, square), for black to move, for each of the 16 castling rights
+combinations and for each en-passant file. The key of a position is the XOR of the numbers of its features.
+A fixed seed keeps the keys identical across processes and runs.
+'''
+zobristRandom = random.Random(20220522)
+zobristPieces = {color + piece: [zobristRandom.getrandbits(64) for _ in range(64)]
+                 for color in "wb" for piece in "pRNBQK"}
+zobristBlackToMove = zobristRandom.getrandbits(64)
+zobristCastling = [zobristRandom.getrandbits(64) for _ in range(16)]
+zobristEnpassant = [zobristRandom.getrandbits(64) for _ in range(8)]
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+'''
+Compact position encoding (see GameState.encodePosition), 30 bytes little endian:
+occupancy bitboard (8), one 4-bit piece code per occupied square in square order (16, at most 32 pieces),
+flags (2: bit 0 black to move, bits 1-4 castling index, bit 8 en-passant possible, bits 5-7 its column),
+halfmove clock (2) and fullmove number (2)
+'''
+POSITION_FORMAT = struct.Struct("<Q16sHHH")
+POSITION_BYTES = POSITION_FORMAT.size
+PIECE_CODES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_CODE_INDEX = {piece: i for i, piece in enumerate(PIECE_CODES)}
+
+#plies (the game and the search below it) whose undo records are allocated with the game state, see pushUndoRecord
+MAX_PLY = 512
+
+#piece values: the material of the AI evaluation (ChessAI.pieceScores), also used to order captures by MVV-LVA
+PIECE_VALUES = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 10, 'K': 0}
+
+#castling rights bits of GameState.castlingRights (the same packing as CastleRights.getIndex)
+WHITE_KINGSIDE = 1
+BLACK_KINGSIDE = 2
+WHITE_QUEENSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING_RIGHTS = 15
+#per square (row * 8 + col), the rights kept when a piece leaves or lands on it: moving a king or a rook from its
+#starting square, or capturing a rook there, loses the rights that depend on it
+castlingRightsKept = [ALL_CASTLING_RIGHTS] * 64
+castlingRightsKept[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE) #e1
+castlingRightsKept[63] &= ~WHITE_KINGSIDE #h1
+castlingRightsKept[56] &= ~WHITE_QUEENSIDE #a1
+castlingRightsKept[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE) #e8
+castlingRightsKept[7] &= ~BLACK_KINGSIDE #h8
+castlingRightsKept[0] &= ~BLACK_QUEENSIDE #a8
+
 class GameState():
 
-    def __init__(self):
+    rookDirections = ((0, 1), (0, -1), (-1, 0), (1, 0))
+    bishopDirections = ((-1, 1), (-1, -1), (1, 1), (1, -1))
+    knightOffsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+    kingOffsets = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+    def __init__(self, fen=None):
         # board is a 8x8 2d list. Each element has 2 characters. The first characters is the color, 'b' or 'w'. The second character represent the type of the piece.
         # '--' represent a square with no pieces on it.
         self.board = [
@@ -21,16 +76,7 @@ class GameState():
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
-        #self.board = [
-        #    ["bR", "bN", "bB", "--", "bK", "bB", "bN", "bR"],
-        #    ["bp", "bp", "bp", "--", "bp", "--", "--", "bp"],
-        #    ["--","--","--","--","--","--","bp","--"],
-        #    ["--","--","bQ","--","wp","--","wK","--"],
-        #    ["--","--","--","bp","--","--","--","--"],
-        #    ["--","--","--","--","--","--","--","--"],
-        #    ["wp", "wp", "wp", "wp", "wp", "--", "wp", "wp"],
-        #    ["wR", "wN", "wB", "wQ", "--", "wB", "wN", "wR"]
-        #]
+        self.startFen = START_FEN #position the game started from, the move log is played from there
         self.whiteToMove = True
         self.moveLog = []
         self.moveFunctions = {
@@ -52,16 +98,166 @@ class GameState():
         self.inCheck = False
         self.pins = []
         self.checks = []
+        self.attackMap = 0 #squares attacked by the opponent, bit row * 8 + col, set by getValidMoves
         self.enpassantPossible = () ##coordinates for the square when an en-passant capture is possible
-        self.enpassantPossibleLog = [self.enpassantPossible]
-        self.currentCastlingRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
-                                            self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)] 
+        self.castlingRights = ALL_CASTLING_RIGHTS #4 bits, see WHITE_KINGSIDE...
+        self.halfmoveClock = 0 #half moves since the last capture or pawn move, for the fifty-move rule
+        self.pieceCount = 32 #pieces on the board, kings included
+        self.nonPawnCounts = {'w': 7, 'b': 7} #knights, bishops, rooks and queens of each color
+        self.fullmoveNumber = 1 #starts at 1 and is incremented after each black move
+        self.zobristKey = self.computeZobristKey()
+        #what undoMove restores, one record per ply of moveLog. Records are reused, so making a move allocates nothing
+        self.undoStack = [UndoRecord() for _ in range(MAX_PLY)]
+        #zobrist keys of the positions before the starting one, back to the last capture or pawn move, when they are
+        #known (see fromSnapshot)
+        self.priorKeys = []
+        #incremental evaluation, off until enableIncrementalEval is called
+        self.materialTable = None
+        self.positionTable = None
+        self.materialScore = 0
+        self.positionScore = 0
+        if fen is not None:
+            self.loadFen(fen)
+
+
+
+    '''
+    Set up the position described by a FEN string. The move log is cleared
+    '''
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError("Invalid FEN, it needs at least the piece placement and the side to move: " + fen)
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(['--'] * int(ch))
+                elif ch.upper() in "PNBRQK":
+                    row.append(('w' if ch.isupper() else 'b') + ('p' if ch.upper() == 'P' else ch.upper()))
+                else:
+                    raise ValueError("Invalid piece '{}' in FEN: {}".format(ch, fen))
+            if len(row) != 8:
+                raise ValueError("Invalid rank '{}' in FEN: {}".format(rank, fen))
+            board.append(row)
+        if len(board) != 8:
+            raise ValueError("Invalid FEN, it must have 8 ranks: " + fen)
+        self.board = board
+        self.startFen = fen
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+        self.pieceCount = sum(piece != '--' for row in board for piece in row)
+        self.nonPawnCounts = {color: sum(piece[0] == color and piece[1] in 'NBRQ' for row in board for piece in row)
+                              for color in 'wb'}
+        self.whiteToMove = fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.castlingRights = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling).getIndex()
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        self.enpassantPossible = ()
+        if enpassant != '-':
+            row, col = Move.rankToRows[enpassant[1]], Move.filesToCols[enpassant[0]]
+            pawnRow = row + 1 if self.whiteToMove else row - 1
+            if self.hasPawnBeside(pawnRow, col, 'w' if self.whiteToMove else 'b'): #same rule as makeMove
+                self.enpassantPossible = (row, col)
+        try:
+            self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("Invalid move counters in FEN: " + fen)
+        self.moveLog = []
+        self.priorKeys = []
+        self.checkMate = False
+        self.staleMate = False
+        self.inCheck = False
+        self.pins = []
+        self.checks = []
+        self.zobristKey = self.computeZobristKey()
+        if self.positionTable is not None:
+            self.enableIncrementalEval(self.materialTable, self.positionTable)
+
+
+    '''
+    FEN string of the current position
+    '''
+    def getFen(self):
+        enpassant = '-'
+        if self.enpassantPossible:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowToRanks[self.enpassantPossible[0]]
+        return "{} {} {} {} {} {}".format(getFenPlacement(self.board), 'w' if self.whiteToMove else 'b',
+                                          getFenCastling(self.castlingRights), enpassant,
+                                          self.halfmoveClock, self.fullmoveNumber)
+
+
+    '''
+    Current position packed in POSITION_BYTES bytes, see POSITION_FORMAT. loadPosition does the reverse
+    '''
+    def encodePosition(self):
+        occupancy = 0
+        pieces = bytearray(16)
+        numPieces = 0
+        for sq in range(64):
+            piece = self.board[sq >> 3][sq & 7]
+            if piece != '--':
+                if numPieces == 32:
+                    raise ValueError("Can't encode a position with more than 32 pieces")
+                occupancy |= 1 << sq
+                pieces[numPieces >> 1] |= PIECE_CODE_INDEX[piece] << (4 * (numPieces & 1))
+                numPieces += 1
+        flags = (not self.whiteToMove) | (self.castlingRights << 1)
+        if self.enpassantPossible:
+            flags |= (8 | self.enpassantPossible[1]) << 5
+        return POSITION_FORMAT.pack(occupancy, bytes(pieces), flags, self.halfmoveClock, self.fullmoveNumber)
+
+
+    '''
+    True if a pawn of the given color stands next to (r, c) on the same rank
+    '''
+    def hasPawnBeside(self, r, c, color):
+        pawn = color + 'p'
+        return (c > 0 and self.board[r][c - 1] == pawn) or (c < 7 and self.board[r][c + 1] == pawn)
 
 
+    '''
+    Set up a position encoded by encodePosition. The move log is cleared
+    '''
+    def loadPosition(self, data):
+        self.loadFen(decodePosition(data))
+
+
+    '''
+    What a search needs of the game, to send it to another process: the position packed by encodePosition, followed
+    by the zobrist keys of the positions since the last capture or pawn move (8 bytes each), the ones a repetition can
+    come from. The move log is left out. Rebuilt with fromSnapshot
+    '''
+    def snapshot(self):
+        keys = self.priorKeys + [record.zobristKey for record in self.undoStack[:len(self.moveLog)]]
+        keys = keys[len(keys) - min(self.halfmoveClock, len(keys)):]
+        return self.encodePosition() + struct.pack("<{}Q".format(len(keys)), *keys)
+
+
+    '''
+    A game state, of this class, in the position of a snapshot. Its move log is empty and its priorKeys are the keys
+    of the snapshot
+    '''
+    @classmethod
+    def fromSnapshot(cls, data):
+        gs = cls(decodePosition(data[:POSITION_BYTES]))
+        keysData = data[POSITION_BYTES:]
+        if len(keysData) % 8:
+            raise ValueError("Invalid snapshot, {} bytes of keys is not a whole number of keys".format(len(keysData)))
+        gs.priorKeys = list(struct.unpack("<{}Q".format(len(keysData) // 8), keysData))
+        return gs
 
 
     def makeMove(self, move):
+        previousEnpassant = self.enpassantPossible
+        previousCastlingIndex = self.castlingRights
+        self.pushUndoRecord()
         self.board[move.startRow][move.startCol] = '--'
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)
@@ -70,10 +266,12 @@ class GameState():
         elif move.pieceMoved == 'bK':
             self.blackKingLocation = (move.endRow, move.endCol)
         self.whiteToMove = not self.whiteToMove 
+        if self.whiteToMove: #black just moved
+            self.fullmoveNumber += 1
 
         #Is pawn promotion?
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
 
         #En-passant
         if move.isEnpassantMove:
@@ -83,8 +281,10 @@ class GameState():
         #else:
         #    move.pieceCaptured = self.board[move.endRow][move.endCol]
         
-        #update enpassantpossible variable.
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2: #only on 2 square pawn advances
+        #update enpassantpossible variable, only on 2 square pawn advances. Only set when an enemy pawn stands beside the
+        #pawn to take it, so positions that differ by an en-passant square nobody can use get the same zobrist key
+        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2 and \
+                self.hasPawnBeside(move.endRow, move.endCol, self.enemyPiece[move.pieceMoved[0] == 'w']):
             self.enpassantPossible = ( (move.startRow + move.endRow)//2, move.startCol)
         else:
             self.enpassantPossible = ()
@@ -103,45 +303,189 @@ class GameState():
                 #remove the rook from old square
                 self.board[move.endRow][move.endCol-2] = '--'
 
-
-        self.enpassantPossibleLog.append(self.enpassantPossible)
+        #update the fifty-move rule clock
+        if move.pieceMoved[1] == 'p' or move.isCapture:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if move.isCapture:
+            self.pieceCount -= 1
+            if move.pieceCaptured[1] != 'p':
+                self.nonPawnCounts[move.pieceCaptured[0]] -= 1
+        if move.isPawnPromotion:
+            self.nonPawnCounts[move.pieceMoved[0]] += 1
 
         #update castling rights
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks,
-                                            self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
+
+        #update the zobrist key
+        self.zobristKey = self.updateZobristKey(move, previousEnpassant, previousCastlingIndex)
+
+        #update the evaluation totals
+        if self.positionTable is not None:
+            materialDelta, positionDelta = self.getEvalDelta(move, self.board[move.endRow][move.endCol])
+            self.materialScore += materialDelta
+            self.positionScore += positionDelta
+
+
+
+    '''
+    Pass the turn without moving (a null move), for the null-move pruning of the search. It is recorded in the move
+    log as None and taken back by undoMove like any other move
+    '''
+    def makeNullMove(self):
+        previousEnpassant = self.enpassantPossible
+        self.pushUndoRecord()
+        self.moveLog.append(None)
+        self.whiteToMove = not self.whiteToMove
+        if self.whiteToMove:
+            self.fullmoveNumber += 1
+        self.enpassantPossible = ()
+        self.halfmoveClock += 1
+        self.zobristKey ^= zobristBlackToMove
+        if previousEnpassant != ():
+            self.zobristKey ^= zobristEnpassant[previousEnpassant[1]]
+
+
+    def undoNullMove(self):
+        self.moveLog.pop()
+        self.whiteToMove = not self.whiteToMove
+        if not self.whiteToMove:
+            self.fullmoveNumber -= 1
+        self.popUndoRecord()
+
+
+    '''
+    Save what makeMove can't recompute when the move is taken back, in the record of the ply about to be played.
+    Called before the move is added to moveLog. A game longer than MAX_PLY plies gets a new record for each ply past it
+    '''
+    def pushUndoRecord(self):
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.append(UndoRecord())
+        record = self.undoStack[ply]
+        record.enpassantPossible = self.enpassantPossible
+        record.castlingRights = self.castlingRights
+        record.halfmoveClock = self.halfmoveClock
+        record.zobristKey = self.zobristKey
+
+
+    '''
+    Restore the state saved by pushUndoRecord. Called after the move was removed from moveLog
+    '''
+    def popUndoRecord(self):
+        record = self.undoStack[len(self.moveLog)]
+        self.enpassantPossible = record.enpassantPossible
+        self.castlingRights = record.castlingRights
+        self.halfmoveClock = record.halfmoveClock
+        self.zobristKey = record.zobristKey
+
+
+    '''
+    The castling rights as a CastleRights object, kept for compatibility. It is a copy: changing it does not change
+    the game state, assigning one does
+    '''
+    @property
+    def currentCastlingRights(self):
+        return CastleRights.fromIndex(self.castlingRights)
+
+
+    @currentCastlingRights.setter
+    def currentCastlingRights(self, rights):
+        self.castlingRights = rights.getIndex()
+
+
+    '''
+    True if the side to move is in check. Unlike the inCheck attribute, it doesn't need the moves to be generated
+    '''
+    def isKingInCheck(self):
+        return self.checkForPinsAndChecks()[0]
+
+
+    '''
+    How many times (at most maxCount) the current position occurred before. Only the positions since the last capture
+    or pawn move (halfmoveClock plies) can repeat it, and only every other one (same side to move), so at most
+    halfmoveClock / 2 zobrist keys of the undo records and priorKeys are compared. The search stops at a null move
+    '''
+    def countRepetitions(self, maxCount=2):
+        if self.halfmoveClock < 4:
+            return 0
+        key = self.zobristKey
+        moveLog = self.moveLog
+        undoStack = self.undoStack
+        priorKeys = self.priorKeys
+        ply = len(moveLog)
+        count = 0
+        for index in range(ply - 2, ply - 1 - self.halfmoveClock, -2):
+            if index >= 0:
+                if moveLog[index] is None or moveLog[index + 1] is None:
+                    break
+                positionKey = undoStack[index].zobristKey #key of the position at that ply
+            elif len(priorKeys) + index >= 0:
+                positionKey = priorKeys[index]
+            else:
+                break
+            if positionKey == key:
+                count += 1
+                if count >= maxCount:
+                    break
+        return count
 
 
+    '''
+    True if the game is drawn by the fifty-move rule or by repetition, i.e. the position occurred repetitions times
+    before (2 for the threefold repetition rule; the search uses 1, repeating once is enough to hold the draw)
+    '''
+    def isDraw(self, repetitions=2):
+        return self.halfmoveClock >= 100 or self.countRepetitions(repetitions) >= repetitions
+
+
+    '''
+    True if the side given has a piece other than pawns and the king. Null-move pruning is unsafe without one
+    (zugzwang is common in such endgames)
+    '''
+    def hasNonPawnMaterial(self, white):
+        return self.nonPawnCounts['w' if white else 'b'] != 0
+
 
     def undoMove(self):
-        if len(self.moveLog) != 0:
+        if len(self.moveLog) != 0 and self.moveLog[-1] is None:
+            self.undoNullMove()
+        elif len(self.moveLog) != 0:
             move = self.moveLog.pop()
+            if self.positionTable is not None:
+                materialDelta, positionDelta = self.getEvalDelta(move, self.board[move.endRow][move.endCol])
+                self.materialScore -= materialDelta
+                self.positionScore -= positionDelta
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
+            if move.isCapture:
+                self.pieceCount += 1
+                if move.pieceCaptured[1] != 'p':
+                    self.nonPawnCounts[move.pieceCaptured[0]] += 1
+            if move.isPawnPromotion:
+                self.nonPawnCounts[move.pieceMoved[0]] -= 1
             
             if move.pieceMoved == 'wK':
                 self.whiteKingLocation = (move.startRow, move.startCol)
             elif move.pieceMoved == 'bK':
                 self.blackKingLocation = (move.startRow, move.startCol)
             self.whiteToMove = not self.whiteToMove
+            if not self.whiteToMove: #taking back a black move
+                self.fullmoveNumber -= 1
 
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '--'
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
                 #self.enpassantPossible = (move.endRow, move.endCol)
                 
-            
-            self.enpassantPossibleLog.pop()
-            self.enpassantPossible = self.enpassantPossibleLog[-1]
+            #undo the en-passant square, fifty-move clock, castling rights and zobrist key
+            self.popUndoRecord()
             
             #undo 2 square pawn advance
             #if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
             #    self.enpassantPossible = ()
 
-            #undo castling rights
-            self.castleRightsLog.pop()
-            self.currentCastlingRights = self.castleRightsLog[-1]
-
             #undo castlemove
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2: #kingside castle
@@ -157,38 +501,100 @@ class GameState():
 
 
 
+    '''
+    Zobrist key of the current position computed from scratch
+    '''
+    def computeZobristKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    key ^= zobristPieces[piece][r * 8 + c]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        key ^= zobristCastling[self.castlingRights]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        return key
+
+
+    '''
+    Zobrist key after move, obtained from the current key by XOR-ing in and out only the features the move changed.
+    Called at the end of makeMove, with the en-passant square and castling rights as they were before the move
+    '''
+    def updateZobristKey(self, move, previousEnpassant, previousCastlingIndex):
+        key = self.zobristKey
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        key ^= zobristPieces[move.pieceMoved][startSq]
+        key ^= zobristPieces[self.board[move.endRow][move.endCol]][endSq] #the promoted piece on promotions
+        if move.isEnpassantMove:
+            key ^= zobristPieces[move.pieceCaptured][move.startRow * 8 + move.endCol]
+        elif move.pieceCaptured != '--':
+            key ^= zobristPieces[move.pieceCaptured][endSq]
+        if move.isCastleMove:
+            rookKeys = zobristPieces[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2: #kingside castle
+                key ^= rookKeys[endSq + 1] ^ rookKeys[endSq - 1]
+            else:
+                key ^= rookKeys[endSq - 2] ^ rookKeys[endSq + 1]
+        key ^= zobristBlackToMove
+        if previousEnpassant != ():
+            key ^= zobristEnpassant[previousEnpassant[1]]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        key ^= zobristCastling[previousCastlingIndex] ^ zobristCastling[self.castlingRights]
+        return key
+
+
+    '''
+    Keep running material and piece-square totals, updated by makeMove and undoMove, so the position can be evaluated
+    without scanning the board. materialTable maps a piece to its value, positionTable maps a piece to a list of 64
+    values indexed by row*8 + col. Values of black pieces are expected to be negative
+    '''
+    def enableIncrementalEval(self, materialTable, positionTable):
+        self.materialTable = materialTable
+        self.positionTable = positionTable
+        self.materialScore = 0
+        self.positionScore = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.materialScore += materialTable[piece]
+                    self.positionScore += positionTable[piece][r * 8 + c]
+
+
+    '''
+    Change of the material and piece-square totals caused by move. pieceLanded is the piece on the end square after
+    the move (the promoted piece on promotions)
+    '''
+    def getEvalDelta(self, move, pieceLanded):
+        positionTable = self.positionTable
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        materialDelta = self.materialTable[pieceLanded] - self.materialTable[move.pieceMoved]
+        positionDelta = positionTable[pieceLanded][endSq] - positionTable[move.pieceMoved][startSq]
+        if move.pieceCaptured != '--':
+            captureSq = move.startRow * 8 + move.endCol if move.isEnpassantMove else endSq
+            materialDelta -= self.materialTable[move.pieceCaptured]
+            positionDelta -= positionTable[move.pieceCaptured][captureSq]
+        if move.isCastleMove:
+            rookTable = positionTable[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2: #kingside castle
+                positionDelta += rookTable[endSq - 1] - rookTable[endSq + 1]
+            else:
+                positionDelta += rookTable[endSq + 1] - rookTable[endSq - 2]
+        return materialDelta, positionDelta
+
+
+    '''
+    Clear the castling rights lost by move: a king or rook leaving its starting square, or a rook captured on it
+    '''
     def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastlingRights.wks = False
-            self.currentCastlingRights.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastlingRights.bks = False
-            self.currentCastlingRights.bqs = False
-        elif move.pieceMoved[1] == 'R':
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastlingRights.wqs = False
-                if move.startCol == 7:
-                    self.currentCastlingRights.wks = False
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastlingRights.bqs = False
-                if move.startCol == 7:
-                    self.currentCastlingRights.bks = False
-        
-        #if a rook is captured
-        if move.pieceCaptured[1] == 'R':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRights.wqs = False
-                if move.endCol == 7:
-                    self.currentCastlingRights.wks = False
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRights.bqs = False
-                if move.endCol == 7:
-                    self.currentCastlingRights.bks = False
-                
+        self.castlingRights &= castlingRightsKept[move.startRow * 8 + move.startCol] & \
+            castlingRightsKept[move.endRow * 8 + move.endCol]
 
 
 
@@ -230,48 +636,7 @@ class GameState():
 
 
 
-        ### TODO: If in check, it does not allow to capture the piece that is checking!!
-
-
-        moves = []
-        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        #print(self.inCheck)
-
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingCol = self.whiteKingLocation[1]
-        else:
-            kingRow = self.blackKingLocation[0]
-            kingCol = self.blackKingLocation[1]
-        if self.inCheck:
-            if len(self.checks) == 1:
-                moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol][1]
-                validSquares = []
-                if pieceChecking == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1,8):
-                        validSquare = (kingRow + check[2]*i, kingCol + check[3]*i) #check[2] and check[3] are the check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol: #you get to the piece that checks
-                            break
-                # get rid of moves that do not deal with the check
-                #print(moves)
-                #print(validSquares)
-                for i in range(len(moves)-1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K': #Move does not move the king so it must block or capture
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-                #print(moves)
-            else: #Double check, king has to move
-                self.getKingMoves(kingRow, kingCol, moves)
-        else: #not in check so all moves are fine
-            moves = self.getAllPossibleMoves()
-
+        moves = self.generateMoves(self.getCheckInfo(), True, True)
 
         if len(moves) == 0: #Either checkmate or stalemate
             if self.inCheck:
@@ -288,6 +653,210 @@ class GameState():
         return moves
 
 
+    '''
+    What the generator needs to know about checks and pins in the current position: (in check, pins, checks, squares
+    that capture the checking piece or block the check (None in double check), king row, king col, attack map).
+    Sets inCheck, pins, checks and attackMap
+    '''
+    def getCheckInfo(self):
+        self.attackMap = self.getAttackMap()
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.whiteToMove:
+            kingRow = self.whiteKingLocation[0]
+            kingCol = self.whiteKingLocation[1]
+        else:
+            kingRow = self.blackKingLocation[0]
+            kingCol = self.blackKingLocation[1]
+        validSquares = None
+        if self.inCheck and len(self.checks) == 1:
+            check = self.checks[0]
+            checkRow = check[0]
+            checkCol = check[1]
+            pieceChecking = self.board[checkRow][checkCol][1]
+            validSquares = set() #squares that capture the checking piece or block the check
+            if pieceChecking == 'N':
+                validSquares.add((checkRow, checkCol))
+            else:
+                for i in range(1,8):
+                    validSquare = (kingRow + check[2]*i, kingCol + check[3]*i) #check[2] and check[3] are the check directions
+                    validSquares.add(validSquare)
+                    if validSquare[0] == checkRow and validSquare[1] == checkCol: #you get to the piece that checks
+                        break
+        return self.inCheck, tuple(self.pins), self.checks, validSquares, kingRow, kingCol, self.attackMap
+
+
+    '''
+    Legal captures and promotions if captures, the other legal moves if quiets. checkInfo comes from getCheckInfo
+    and the position must not have changed since. The moves are added to moves (a new list if None), which is returned
+    '''
+    def generateMoves(self, checkInfo, captures, quiets, moves=None):
+        inCheck, pins, checks, validSquares, kingRow, kingCol, attackMap = checkInfo
+        #the piece functions read these (a search may have changed them since), and take the pins off the list
+        self.inCheck, self.pins, self.checks, self.attackMap = inCheck, list(pins), checks, attackMap
+        if moves is None:
+            moves = []
+        if inCheck and validSquares is None: #Double check, king has to move
+            self.getKingMoves(kingRow, kingCol, moves, captures, quiets)
+            return moves
+        self.getAllPossibleMoves(captures, quiets, moves)
+        if inCheck:
+            # get rid of moves that do not deal with the check
+            moves[:] = [move for move in moves if move.pieceMoved[1] == 'K' or #King moves are already checked
+                     (move.endRow, move.endCol) in validSquares or
+                     (move.isEnpassantMove and (move.startRow, move.endCol) in validSquares)]
+        return moves
+
+
+    '''
+    Legal captures and promotions only, generated without the quiet moves, for the quiescence search. Sets inCheck,
+    does not update checkMate and staleMate
+    '''
+    def getCaptureMoves(self):
+        return self.generateMoves(self.getCheckInfo(), True, False)
+
+
+    '''
+    Legal moves in the order a search should try them, each stage generated only when the previous ones are used
+    up, so a cutoff on an early move saves the rest of the generation:
+        1. the hash move (hashMoveID), if legal here, before any generation
+        2. the captures and promotions that win material (victim worth at least the attacker), by MVV-LVA
+        3. the killer moves (killerIDs) that are legal here, checked one by one before the quiet moves are generated
+        4. the other captures, by MVV-LVA
+        5. the other quiet moves, by historyScores[(piece moved, end square)]
+    With capturesOnly, stages 3 and 5 are skipped. With shuffle, moves scored the same come in random order.
+    The moves are generated into moveBuffer if given, a list the caller keeps for this ply and does not touch until
+    the generator is done with. Moves can be made and undone between two steps. Does not update checkMate and staleMate
+    '''
+    def iterStagedMoves(self, hashMoveID=None, killerIDs=(), historyScores=None, capturesOnly=False, shuffle=False,
+                        moveBuffer=None):
+        checkInfo = self.getCheckInfo()
+        if hashMoveID is not None:
+            hashMove = self.getLegalMove(hashMoveID, checkInfo)
+            if hashMove is not None and (not capturesOnly or hashMove.isCapture or hashMove.isPawnPromotion):
+                yield hashMove
+            else:
+                hashMoveID = None
+
+        if moveBuffer is not None:
+            moveBuffer.clear()
+        captures = self.generateMoves(checkInfo, True, False, moveBuffer)
+        if shuffle:
+            random.shuffle(captures) #the sorts are stable, so this only changes the order of equally scored moves
+        captures.sort(key=getCaptureOrder, reverse=True)
+        losingCaptures = []
+        for move in captures:
+            if move.moveID == hashMoveID:
+                continue
+            if move.isCapture and not move.isPawnPromotion and \
+                    PIECE_VALUES[move.pieceCaptured[1]] < PIECE_VALUES[move.pieceMoved[1]]:
+                losingCaptures.append(move)
+                continue
+            yield move
+        if capturesOnly:
+            yield from losingCaptures
+            return
+
+        killersTried = []
+        for killerID in killerIDs:
+            if killerID is None or killerID == hashMoveID or killerID in killersTried:
+                continue
+            killer = self.getLegalMove(killerID, checkInfo)
+            if killer is not None and not (killer.isCapture or killer.isPawnPromotion): #captures were tried already
+                killersTried.append(killerID)
+                yield killer
+        yield from losingCaptures
+        if moveBuffer is not None:
+            moveBuffer.clear() #the captures are used up
+        quiets = self.generateMoves(checkInfo, False, True, moveBuffer)
+        if shuffle:
+            random.shuffle(quiets)
+        if historyScores:
+            quiets.sort(key=lambda move: historyScores.get((move.pieceMoved, move.endRow * 8 + move.endCol), 0),
+                        reverse=True)
+        for move in quiets:
+            if move.moveID != hashMoveID and move.moveID not in killersTried:
+                yield move
+
+
+    '''
+    The move with this ID if it is legal in the current position, else None. Used for the hash and killer moves, which
+    were found in other positions (killers) or may come from a position sharing the zobrist key: only the moves of the
+    piece on the start square are generated. checkInfo comes from getCheckInfo
+    '''
+    def getLegalMove(self, moveID, checkInfo):
+        r, c = (moveID >> 3) & 7, moveID & 7
+        piece = self.board[r][c]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        inCheck, pins, checks, validSquares, kingRow, kingCol, attackMap = checkInfo
+        if inCheck and validSquares is None and piece[1] != 'K': #Double check, king has to move
+            return None
+        self.inCheck, self.pins, self.checks, self.attackMap = inCheck, list(pins), checks, attackMap
+        moves = []
+        self.moveFunctions[piece[1]](r, c, moves)
+        for move in moves:
+            if move.moveID == moveID:
+                if inCheck and piece[1] != 'K' and (move.endRow, move.endCol) not in validSquares and \
+                        not (move.isEnpassantMove and (move.startRow, move.endCol) in validSquares):
+                    return None
+                return move
+        return None
+
+
+    '''
+    Squares attacked by the opponent of the side to move, as a 64 bit mask (bit row * 8 + col), computed once per
+    position by getValidMoves and queried by the king and castling moves. The rays go through the king of the side to
+    move, so the king can't step back along the line of a slider that checks it
+    '''
+    def getAttackMap(self):
+        board = self.board
+        enemyColor = self.enemyPiece[self.whiteToMove]
+        allyKing = ('w' if self.whiteToMove else 'b') + 'K'
+        attacks = 0
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != enemyColor:
+                    continue
+                pieceType = piece[1]
+                if pieceType == 'p':
+                    endRow = r + 1 if enemyColor == 'b' else r - 1
+                    if 0 <= endRow <= 7:
+                        if c > 0:
+                            attacks |= 1 << (endRow * 8 + c - 1)
+                        if c < 7:
+                            attacks |= 1 << (endRow * 8 + c + 1)
+                elif pieceType == 'N' or pieceType == 'K':
+                    for dr, dc in self.knightOffsets if pieceType == 'N' else self.kingOffsets:
+                        endRow, endCol = r + dr, c + dc
+                        if 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                            attacks |= 1 << (endRow * 8 + endCol)
+                else:
+                    if pieceType == 'R':
+                        directions = self.rookDirections
+                    elif pieceType == 'B':
+                        directions = self.bishopDirections
+                    else:
+                        directions = self.rookDirections + self.bishopDirections
+                    for dr, dc in directions:
+                        endRow, endCol = r + dr, c + dc
+                        while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                            attacks |= 1 << (endRow * 8 + endCol)
+                            target = board[endRow][endCol]
+                            if target != '--' and target != allyKing:
+                                break
+                            endRow += dr
+                            endCol += dc
+        return attacks
+
+
+    '''
+    True if the opponent attacks (r, c), according to the attack map of the position (see getAttackMap)
+    '''
+    def isSquareAttacked(self, r, c):
+        return (self.attackMap >> (r * 8 + c)) & 1 == 1
+
+
     def checkForPinsAndChecks(self, is_king=True, r=None, c=None):
 
         #print("Check for pins and checks")
@@ -397,22 +966,23 @@ class GameState():
     '''
 
     '''
-    All moves without considering checks
+    All moves without considering checks, added to moves (a new list if None)
     '''
-    def getAllPossibleMoves(self):
-        moves = []
+    def getAllPossibleMoves(self, captures=True, quiets=True, moves=None):
+        if moves is None:
+            moves = []
         for r in range(len(self.board)):
             for c in range(len(self.board[r])):
                 turn = self.board[r][c][0]
                 
                 if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
                     piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
+                    self.moveFunctions[piece](r, c, moves, captures, quiets)
         return moves
 
 
 
-    def getPawnMoves(self, r, c, moves):
+    def getPawnMoves(self, r, c, moves, captures=True, quiets=True):
         
         piecePinned = False
         pinDirection = ()
@@ -423,147 +993,125 @@ class GameState():
                 self.pins.remove(self.pins[i])
                 break
         
-        #TODO: Weird bug when en-passant is not possible because there is a pin
+        #en-passant takes two pawns off the same rank at once, which can expose the king to a rook or queen
+        enpassantSquare = self.enpassantPossible
+        if enpassantSquare != () and abs(enpassantSquare[1] - c) == 1 and self.enpassantExposesKing(r, c, enpassantSquare[1]):
+            enpassantSquare = ()
 
         if self.whiteToMove:
             kingRow, kingCol = self.whiteKingLocation
-            if self.board[r-1][c] == '--': #1 square advance
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r,c), (r-1, c), self.board))
+            if self.board[r-1][c] == '--' and (captures if r == 1 else quiets): #1 square advance, promotions go with the captures
+                if not piecePinned or pinDirection in ((-1, 0), (1, 0)): #the king can be behind or in front of the pawn
+                    self.addPawnMove((r,c), (r-1, c), moves)
                     if r == 6 and self.board[r-2][c] == '--': #2 squares advance
                         moves.append(Move((r,c), (r-2, c), self.board))
-            if c-1 >= 0:
-                isEnpassantMove = ((r-1, c-1) == self.enpassantPossible)
+            if captures and c-1 >= 0:
+                isEnpassantMove = ((r-1, c-1) == enpassantSquare)
                 if self.board[r-1][c-1][0] == 'b' or isEnpassantMove: #enemy piece to capture diagonally to the left
                     if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((r,c), (r-1, c-1), self.board, isEnpassantMove))
-            if c+1 <= 7:
-                isEnpassantMove = ((r-1, c+1) == self.enpassantPossible)
+                        self.addPawnMove((r,c), (r-1, c-1), moves, isEnpassantMove)
+            if captures and c+1 <= 7:
+                isEnpassantMove = ((r-1, c+1) == enpassantSquare)
                 if self.board[r-1][c+1][0] == 'b' or isEnpassantMove: #enemy piece to capture diagonally to the right
                     if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((r,c), (r-1, c+1), self.board, isEnpassantMove))
+                        self.addPawnMove((r,c), (r-1, c+1), moves, isEnpassantMove)
         else: #black pawn moves
             kingRow, kingCol = self.blackKingLocation
-            if self.board[r+1][c] == '--': #1 square advance
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r,c), (r+1, c), self.board))
+            if self.board[r+1][c] == '--' and (captures if r == 6 else quiets): #1 square advance
+                if not piecePinned or pinDirection in ((1, 0), (-1, 0)):
+                    self.addPawnMove((r,c), (r+1, c), moves)
                     if r == 1 and self.board[r+2][c] == '--': #2 squares advance
                         moves.append(Move((r,c), (r+2, c), self.board))
-            if c-1 >= 0:
-                isEnpassantMove = ((r+1, c-1) == self.enpassantPossible)
+            if captures and c-1 >= 0:
+                isEnpassantMove = ((r+1, c-1) == enpassantSquare)
                 if self.board[r+1][c-1][0] == 'w' or isEnpassantMove: #enemy piece to capture diagonally to the left
                     if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((r,c), (r+1, c-1), self.board, isEnpassantMove))
-            if c+1 <= 7:
-                isEnpassantMove = ((r+1, c+1) == self.enpassantPossible)
+                        self.addPawnMove((r,c), (r+1, c-1), moves, isEnpassantMove)
+            if captures and c+1 <= 7:
+                isEnpassantMove = ((r+1, c+1) == enpassantSquare)
                 if self.board[r+1][c+1][0] == 'w' or isEnpassantMove: #enemy piece to capture diagonally to the right
                     if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((r,c), (r+1, c+1), self.board, isEnpassantMove))
+                        self.addPawnMove((r,c), (r+1, c+1), moves, isEnpassantMove)
 
 
-    def getRookMoveOffset(self, r, c, direction, k):
-        offsets = {
-            'east': (r, c+1+k),
-            'west': (r, c-1-k),
-            'north': (r-1-k, c),
-            'south': (r+1+k, c)
-        }
-        return offsets[direction]
+    '''
+    True if capturing en-passant with the pawn in (r, c) would leave the king attacked along the rank by a rook or
+    queen, once both pawns are gone
+    '''
+    def enpassantExposesKing(self, r, c, capturedCol):
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if kingRow != r:
+            return False
+        step = 1 if c > kingCol else -1
+        col = kingCol + step
+        while 0 <= col <= 7:
+            if col != c and col != capturedCol and self.board[r][col] != '--':
+                piece = self.board[r][col]
+                return piece[0] == self.enemyPiece[self.whiteToMove] and piece[1] in ('R', 'Q')
+            col += step
+        return False
 
-    def getRookMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
+
+    '''
+    Add a pawn move, or one move per promotion piece if the pawn reaches the last rank
+    '''
+    def addPawnMove(self, startSq, endSq, moves, isEnpassantMove=False):
+        if endSq[0] == 0 or endSq[0] == 7:
+            for promotionPiece in Move.promotionPieces:
+                moves.append(Move(startSq, endSq, self.board, promotionPiece=promotionPiece))
+        else:
+            moves.append(Move(startSq, endSq, self.board, isEnpassantMove))
+
+
+    '''
+    Pin direction of the piece in (r, c), () if it is not pinned. The pin is removed from self.pins if removePin
+    '''
+    def getPinDirection(self, r, c, removePin=True):
         for i in range(len(self.pins)-1, -1, -1):
             if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2],self.pins[i][3])
-                if (self.board[r][c][1] != 'Q'): #Can't remove queen from pin on rook moves
+                pinDirection = (self.pins[i][2], self.pins[i][3])
+                if removePin:
                     self.pins.remove(self.pins[i])
-                break
+                return pinDirection
+        return ()
 
 
-        conds_east = [self.board[r][x] == '--' for x in range(c+1,8)]
-        conds_west = [self.board[r][x] == '--' for x in range(c-1, -1, -1)]
-        conds_north = [self.board[x][c] == '--' for x in range(r-1, -1, -1)]
-        conds_south = [self.board[x][c] == '--' for x in range(r+1, 8)]
+    def getRookMoves(self, r, c, moves, captures=True, quiets=True):
+        pinDirection = self.getPinDirection(r, c, removePin=self.board[r][c][1] != 'Q') #Can't remove queen from pin on rook moves
+        self.getSlidingMoves(r, c, self.rookDirections, pinDirection, moves, captures, quiets)
 
-        conds = [conds_east, conds_west, conds_north, conds_south]
-        directions = ['east', 'west', 'north', 'south']
-        directions_dict = {
-            'east': (0, 1),
-            'west': (0, -1),
-            'north': (1, 0),
-            'south': (-1, 0)
-        }
-        
-        for direction, cond in zip(directions, conds):
-            #print(r,c, direction, cond)
-            d = directions_dict[direction]
-            for k, v in enumerate(cond):
-                offset = self.getRookMoveOffset( r, c, direction, k)
-                if cond[k]:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        moves.append(Move((r,c), offset, self.board))
-                else:
-                    if self.board[offset[0]][offset[1]][0] == self.enemyPiece[self.whiteToMove]:
-                        if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                            moves.append(Move((r,c), offset, self.board))
-                    break
-                    
-        
-    
-    def getBishopMoveOffset(self, r, c, direction, k):
-        offsets = {
-            'ne': (r-1-k, c+1+k),
-            'nw': (r-1-k, c-1-k),
-            'se': (r+1+k, c+1+k),
-            'sw': (r+1+k, c-1-k)
-        }
-        return offsets[direction]
 
-    def getBishopMoves(self, r, c, moves):
-
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2],self.pins[i][3])
-               
-                self.pins.remove(self.pins[i])
-                break
-        
-        conds_ne = [self.board[r-x][c+x] == '--' for x in range(1,8) if (r-x >= 0) and (c+x <= 7)]
-        conds_nw = [self.board[r-x][c-x] == '--' for x in range(1,8) if (r-x >= 0) and (c-x >= 0)]
-        conds_se = [self.board[r+x][c+x] == '--' for x in range(1,8) if (r+x <= 7) and (c+x <= 7)]
-        conds_sw = [self.board[r+x][c-x] == '--' for x in range(1, 8) if (r+x <= 7) and (c-x >= 0)]
-
-        conds = [conds_ne, conds_nw, conds_se, conds_sw]
-        directions = ['ne', 'nw', 'se', 'sw']
-        directions_dict = {
-            'ne': (1, 1),
-            'nw': (1, -1),
-            'se': (-1, 1),
-            'sw': (-1, -1)
-        }
+    def getBishopMoves(self, r, c, moves, captures=True, quiets=True):
+        pinDirection = self.getPinDirection(r, c)
+        self.getSlidingMoves(r, c, self.bishopDirections, pinDirection, moves, captures, quiets)
 
 
-        for direction, cond in zip(directions, conds):
-            d = directions_dict[direction]
-            for k, v in enumerate(cond):
-                offset = self.getBishopMoveOffset( r, c, direction, k)
-                if cond[k]:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        moves.append(Move((r,c), offset, self.board))
+    '''
+    Moves of a rook, bishop or queen along the given directions, the captures if captures, the others if quiets. A pinned piece
+    only moves along its pin line
+    '''
+    def getSlidingMoves(self, r, c, directions, pinDirection, moves, captures=True, quiets=True):
+        board = self.board
+        enemyColor = self.enemyPiece[self.whiteToMove]
+        for dr, dc in directions:
+            if pinDirection and pinDirection != (dr, dc) and pinDirection != (-dr, -dc):
+                continue
+            endRow, endCol = r + dr, c + dc
+            while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                piece = board[endRow][endCol]
+                if piece == '--':
+                    if quiets:
+                        moves.append(Move((r, c), (endRow, endCol), board))
                 else:
-                    if self.board[offset[0]][offset[1]][0] == self.enemyPiece[self.whiteToMove]:
-                        if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                            moves.append(Move((r,c), offset, self.board))
+                    if captures and piece[0] == enemyColor:
+                        moves.append(Move((r, c), (endRow, endCol), board))
                     break
+                endRow += dr
+                endCol += dc
         
        
 
-    def getKnightMoves(self, r, c, moves):
+    def getKnightMoves(self, r, c, moves, captures=True, quiets=True):
 
         piecePinned = False
         pinDirection = ()
@@ -579,65 +1127,118 @@ class GameState():
         possible_moves = [x for x in all_moves if x[0] >= 0 and x[0] <= 7 and x[1] >= 0 and x[1] <= 7]
         for offset in possible_moves:
             if (self.board[offset[0]][offset[1]]) == '--':
-                if not piecePinned:
+                if not piecePinned and quiets:
                     moves.append(Move((r,c), offset, self.board))
             else:
                 if self.board[offset[0]][offset[1]][0] == self.enemyPiece[self.whiteToMove]:
-                    if not piecePinned:
+                    if not piecePinned and captures:
                         moves.append(Move((r,c), offset, self.board))
 
     
 
-    def getQueenMoves(self, r, c, moves):
-        self.getRookMoves(r,c,moves)
-        self.getBishopMoves(r,c,moves)
+    def getQueenMoves(self, r, c, moves, captures=True, quiets=True):
+        self.getRookMoves(r,c,moves,captures,quiets)
+        self.getBishopMoves(r,c,moves,captures,quiets)
 
-    def getKingMoves(self, r, c, moves):
+    def getKingMoves(self, r, c, moves, captures=True, quiets=True):
         all_moves = [(r+x, c+y) for x in [-1,0,1] for y in [-1, 0, 1]]
         possible_moves = [x for x in all_moves if x[0] >= 0 and x[0] <= 7 and x[1] >= 0 and x[1] <= 7 and (x[0], x[1]) != (r,c)]
         
         for offset in possible_moves:
-            if self.board[offset[0]][offset[1]] == '--' or self.board[offset[0]][offset[1]][0] == self.enemyPiece[self.whiteToMove]:
-                if self.whiteToMove:
-                    self.whiteKingLocation = offset
-                else:
-                    self.blackKingLocation = offset
-                inCheck, pins, checks = self.checkForPinsAndChecks()
-                
-                if not inCheck:
+            if (self.board[offset[0]][offset[1]] == '--' and quiets) or (captures and self.board[offset[0]][offset[1]][0] == self.enemyPiece[self.whiteToMove]):
+                if not self.isSquareAttacked(offset[0], offset[1]):
                     moves.append(Move((r,c), offset, self.board))
-                if self.whiteToMove:
-                    self.whiteKingLocation = (r, c)
-                else:
-                    self.blackKingLocation = (r, c)
         
-        self.getCastleMoves(r,c,moves)
+        if quiets:
+            self.getCastleMoves(r,c,moves)
     
 
     def getCastleMoves(self, r, c, moves):
         if self.inCheck:
             return
-        if (self.whiteToMove and self.currentCastlingRights.wks) or (not self.whiteToMove and self.currentCastlingRights.bks):
+        if self.castlingRights & (WHITE_KINGSIDE if self.whiteToMove else BLACK_KINGSIDE):
             self.getKingSideCastleMoves(r, c, moves)
-        if (self.whiteToMove and self.currentCastlingRights.wqs) or (not self.whiteToMove and self.currentCastlingRights.bqs):
+        if self.castlingRights & (WHITE_QUEENSIDE if self.whiteToMove else BLACK_QUEENSIDE):
             self.getQueenSideCastleMoves(r, c, moves)
         
     
     def getKingSideCastleMoves(self, r, c, moves):
         if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
-            is_under_attack1, _, _ = self.checkForPinsAndChecks(is_king=False, r=r, c=c+1)
-            is_under_attack2, _, _ = self.checkForPinsAndChecks(is_king=False, r=r, c=c+2)
-            if not is_under_attack1 and not is_under_attack2:
+            if not self.isSquareAttacked(r, c+1) and not self.isSquareAttacked(r, c+2):
                 moves.append(Move((r,c), (r, c+2), self.board, isCastleMove=True))
 
 
     def getQueenSideCastleMoves(self, r, c, moves):
         if self.board[r][c-1] == '--' and self.board[r][c-2] == '--' and self.board[r][c-3] == '--':
-            is_under_attack1, _, _ = self.checkForPinsAndChecks(is_king=False, r=r, c=c-1)
-            is_under_attack2, _, _ = self.checkForPinsAndChecks(is_king=False, r=r, c=c-2)
-            if  not is_under_attack1 and not is_under_attack2:
+            if not self.isSquareAttacked(r, c-1) and not self.isSquareAttacked(r, c-2):
                 moves.append(Move((r,c), (r, c-2), self.board, isCastleMove=True))
 
+'''
+Sort key of captures and promotions: most valuable victim first, then least valuable attacker (MVV-LVA)
+'''
+def getCaptureOrder(move):
+    order = 10 * PIECE_VALUES[move.pieceCaptured[1]] - PIECE_VALUES[move.pieceMoved[1]] if move.isCapture else 0
+    if move.isPawnPromotion:
+        order += 10 * PIECE_VALUES[move.promotionPiece]
+    return order
+
+
+'''
+Piece placement field of a FEN string
+'''
+def getFenPlacement(board):
+    ranks = []
+    for row in board:
+        rank = ''
+        empty = 0
+        for piece in row:
+            if piece == '--':
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            letter = 'P' if piece[1] == 'p' else piece[1]
+            rank += letter if piece[0] == 'w' else letter.lower()
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    return '/'.join(ranks)
+
+
+'''
+Castling field of a FEN string from a castling index (see CastleRights.getIndex)
+'''
+def getFenCastling(castlingIndex):
+    castling = ''.join(letter for bit, letter in ((1, 'K'), (4, 'Q'), (2, 'k'), (8, 'q')) if castlingIndex & bit)
+    return castling or '-'
+
+
+'''
+FEN string of a position encoded by GameState.encodePosition
+'''
+def decodePosition(data):
+    if len(data) != POSITION_BYTES:
+        raise ValueError("An encoded position is {} bytes long, got {}".format(POSITION_BYTES, len(data)))
+    occupancy, pieces, flags, halfmoveClock, fullmoveNumber = POSITION_FORMAT.unpack(data)
+    board = [['--'] * 8 for _ in range(8)]
+    numPieces = 0
+    while occupancy:
+        sq = (occupancy & -occupancy).bit_length() - 1
+        occupancy &= occupancy - 1
+        code = (pieces[numPieces >> 1] >> (4 * (numPieces & 1))) & 0xF
+        if code >= len(PIECE_CODES):
+            raise ValueError("Invalid piece code {} in encoded position".format(code))
+        board[sq >> 3][sq & 7] = PIECE_CODES[code]
+        numPieces += 1
+    whiteToMove = not flags & 1
+    enpassant = '-'
+    if flags & 0x100:
+        enpassant = Move.colsToFiles[(flags >> 5) & 7] + ('6' if whiteToMove else '3')
+    return "{} {} {} {} {} {}".format(getFenPlacement(board), 'w' if whiteToMove else 'b',
+                                      getFenCastling((flags >> 1) & 0xF), enpassant, halfmoveClock, fullmoveNumber)
+
+
 class CastleRights():
 
     def __init__(self, wks, bks, wqs, bqs):
@@ -646,36 +1247,90 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    '''
+    The four rights packed in a number between 0 and 15 (GameState.castlingRights), also used to index the zobrist
+    castling keys
+    '''
+    def getIndex(self):
+        return self.wks | (self.bks << 1) | (self.wqs << 2) | (self.bqs << 3)
+
+
+    @classmethod
+    def fromIndex(cls, index):
+        return cls(bool(index & WHITE_KINGSIDE), bool(index & BLACK_KINGSIDE), bool(index & WHITE_QUEENSIDE),
+                   bool(index & BLACK_QUEENSIDE))
+
+
+
+'''
+State restored by undoMove, one per ply (see GameState.pushUndoRecord). The captured piece is kept by the move itself
+'''
+class UndoRecord():
+    __slots__ = ('enpassantPossible', 'castlingRights', 'halfmoveClock', 'zobristKey')
+
+    def __init__(self):
+        self.enpassantPossible = ()
+        self.castlingRights = 0
+        self.halfmoveClock = 0
+        self.zobristKey = 0
+
 
 
 class Move():
 
+    #a move is created for every legal move generated, so keep it small: no per-instance __dict__
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'promotionPiece', 'isEnpassantMove', 'isCapture', 'isCastleMove', 'moveID')
 
     rankToRows = {str(i):8-i for i in range(1, 9)}
     rowToRanks = {v:k for k,v in rankToRows.items()}
     filesToCols = {x: i for i,x in enumerate(list(string.ascii_lowercase[0:8]))}
     colsToFiles = {v:k for k,v in filesToCols.items()}
-
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+    promotionPieces = ['Q', 'R', 'B', 'N']
+    promotionIndex = {piece: i for i, piece in enumerate(promotionPieces)}
+
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False, promotionPiece='Q'):
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        pieceMoved = board[startRow][startCol]
+        self.pieceMoved = pieceMoved
         
         #Pawn promotion
-        self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
+        self.isPawnPromotion = pieceMoved[1] == 'p' and (endRow == 0 or endRow == 7)
+        self.promotionPiece = promotionPiece
         
         #En-passant
         self.isEnpassantMove = isEnpassantMove
-        #(self.pieceMoved[1] == 'p' and (self.endRow, self.endCol) == enpassantPossible)
         if isEnpassantMove:
-            self.pieceCaptured = 'bp' if self.pieceMoved == 'wp' else 'wp'
+            self.pieceCaptured = 'bp' if pieceMoved == 'wp' else 'wp'
+        else:
+            self.pieceCaptured = board[endRow][endCol]
         
         self.isCapture = self.pieceCaptured != '--'
         self.isCastleMove = isCastleMove
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        #packed ID: start square (6 bits), end square (6 bits), promotion piece index (2 bits), see fromID
+        self.moveID = (startRow << 3 | startCol) | (endRow << 3 | endCol) << 6
+        if self.isPawnPromotion: #underpromotions get their own IDs, queen promotions keep the plain one
+            self.moveID |= self.promotionIndex[promotionPiece] << 12
+
+
+    '''
+    Rebuild a move from its moveID, for the position given by board. The en-passant and castle flags follow from
+    the board, so the ID alone is enough to store a move (transposition table, messages between processes)
+    '''
+    @classmethod
+    def fromID(cls, moveID, board):
+        startRow, startCol = (moveID >> 3) & 7, moveID & 7
+        endRow, endCol = (moveID >> 9) & 7, (moveID >> 6) & 7
+        pieceMoved = board[startRow][startCol]
+        isEnpassantMove = pieceMoved[1] == 'p' and startCol != endCol and board[endRow][endCol] == '--'
+        isCastleMove = pieceMoved[1] == 'K' and abs(startCol - endCol) == 2
+        return cls((startRow, startCol), (endRow, endCol), board, isEnpassantMove, isCastleMove,
+                   cls.promotionPieces[moveID >> 12])
 
 
     '''
@@ -692,7 +1347,10 @@ class Move():
 
     def getChessNotation(self):
         #Make this more chess notation
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
 
 
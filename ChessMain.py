@@ -3,11 +3,10 @@ Main driver file. Responsible for handling user input and displaying game state.
 """
 
 from matplotlib import colors
-import ChessEngine, ChessAI
+import ChessEngine, ChessAI, ChessParallel, ChessWorker, ChessSearchStats
 import pygame as p
 import os
 import math
-from multiprocessing import Process, Queue
 
 #os.environ["SDL_VIDEODRIVER"] = "dummy"
 
@@ -17,6 +16,9 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 100
+AI_TIME_LIMIT = 10 #seconds the AI can think per move, None to always search to ChessAI.DEPTH
+AI_PARALLEL = False #spread the AI search over all the CPUs, with a pool of search processes kept for the whole game
+AI_STATS_FILE = None #file to append the statistics of every AI search to, as JSON lines (not with AI_PARALLEL)
 IMAGES = {}
 colors = [p.Color("white"), p.Color("gray")]
 
@@ -54,7 +56,8 @@ def main():
     playerOne = True #If human plays white then True. If AI playing, then false
     playerTwo = False #Same as above but for black
     AIThinking = False
-    moveFinderProcess = None
+    #long-lived AI processes: a pool searching the root moves in parallel if AI_PARALLEL, else a single worker
+    searchWorker = ChessParallel.ParallelSearcher() if AI_PARALLEL else ChessWorker.SearchWorker()
     moveUndone = False
     while running:
 
@@ -99,10 +102,13 @@ def main():
                     moveMade = True
                     animate = False
                     if AIThinking:
-                        moveFinderProcess.terminate()
+                        searchWorker.cancel()
                         AIThinking = False
                     moveUndone = True
                 if e.key == p.K_r: #reset game
+                    if AIThinking:
+                        searchWorker.cancel()
+                        AIThinking = False
                     gs = ChessEngine.GameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
@@ -116,12 +122,12 @@ def main():
         if not gameOver and not humanTurn and not moveUndone:
             if not AIThinking:
                 AIThinking = True
-                returnQueue = Queue() #used to pass data between threads
-                moveFinderProcess = Process(target=ChessAI.findBestMove, args=(gs, validMoves, returnQueue))
-                moveFinderProcess.start()
+                searchWorker.startSearch(gs, timeLimit=AI_TIME_LIMIT)
                 #AIMove = ChessAI.findBestMove(gs, validMoves)
-            if not moveFinderProcess.is_alive():
-                AIMove = returnQueue.get()
+            AIMoveFound, AIMove = searchWorker.getBestMove(validMoves)
+            if AIMoveFound and AI_STATS_FILE is not None and not AI_PARALLEL and searchWorker.searchStats is not None:
+                ChessSearchStats.writeJsonLine(AI_STATS_FILE, searchWorker.searchStats)
+            if AIMoveFound:
                 if (AIMove is None):
                     AIMove = ChessAI.findRandomMove(validMoves)
                 gs.makeMove(AIMove)
@@ -157,9 +163,13 @@ def main():
         elif gs.staleMate:
             gameOver = True
             drawEndGameText(screen, 'Stalemate!')
+        elif gs.isDraw():
+            gameOver = True
+            drawEndGameText(screen, 'Draw by fifty-move rule!' if gs.halfmoveClock >= 100 else 'Draw by repetition!')
 
         clock.tick(MAX_FPS)
         p.display.flip()
+    searchWorker.close()
 
 
 '''
@@ -0,0 +1,237 @@
+"""
+Parallel root-split search. The root moves are shared out over a pool of worker processes (one per CPU by default),
+each worker searching the subtree of one root move at a time with the search algorithm of its own ChessAI.Searcher
+(so its own transposition table and killer/history tables).
+
+The best score found so far is shared between the workers through a multiprocessing.Value and used as the alpha
+(or beta, when black is to move) bound of every new root move, so the workers prune nearly as much as the single
+process search. The bound is loosened by ROOT_SPLIT_EPSILON so that a move as good as the current best still gets an
+exact score: the move returned has the best score and, among equal scores, is the first in root order, like the move
+ChessAI.findBestMove returns at a fixed depth with the same algorithm.
+
+A ParallelSearcher keeps its pool from move to move, so the worker processes are started once and their
+transposition tables stay warm. Each task carries the position as a snapshot (see ChessEngine.GameState.snapshot, a
+few dozen bytes), from which the workers build a BitboardGameState whatever the game state class of the caller.
+"""
+
+import multiprocessing as mp
+import threading
+import time
+import numpy as np
+
+import ChessAI
+import ChessBitboard
+
+ROOT_SPLIT_EPSILON = 1e-3 #well below the smallest score difference (1/50 of a pawn)
+
+#state of a worker process, set by initWorker
+workerGameStateClass = None
+workerGameState = None
+workerSnapshot = None #snapshot workerGameState was built from
+workerSearcher = None
+sharedBound = None
+stopEvent = None
+
+
+'''
+Set up a worker process. The positions come with the tasks, see searchRootMove
+'''
+def initWorker(gameStateClass, algorithm, bound, stop):
+    global workerGameStateClass, workerSearcher, sharedBound, stopEvent
+    workerGameStateClass = gameStateClass
+    workerSearcher = ChessAI.Searcher(algorithm)
+    sharedBound = bound
+    stopEvent = stop
+
+
+'''
+The game state of the worker for the position of snapshot, only built again when the position changed
+'''
+def getWorkerGameState(snapshot):
+    global workerGameState, workerSnapshot
+    if snapshot != workerSnapshot:
+        gs = workerGameStateClass.fromSnapshot(snapshot)
+        if ChessAI.INCREMENTAL_EVAL:
+            gs.enableIncrementalEval(ChessAI.pieceMaterialTable, ChessAI.piecePositionTable)
+        workerGameState, workerSnapshot = gs, snapshot
+    return workerGameState
+
+
+'''
+Search one root move in a worker. task is (index of the move in the root order, snapshot of the root position,
+move ID, depth, deadline). Returns (index, score from white's point of view, nodes); the score is None if the
+deadline was reached or the search was stopped
+'''
+def searchRootMove(task):
+    moveIndex, snapshot, moveID, depth, deadline = task
+    gs = getWorkerGameState(snapshot)
+    maximizingPlayer = gs.whiteToMove
+    color = 1 if maximizingPlayer else -1
+    move = None
+    for m in gs.getValidMoves():
+        if m.moveID == moveID:
+            move = m
+            break
+    bound = sharedBound.value
+    if maximizingPlayer:
+        alpha, beta = bound - ROOT_SPLIT_EPSILON, np.inf
+    else:
+        alpha, beta = -np.inf, bound + ROOT_SPLIT_EPSILON
+    searcher = workerSearcher
+    searcher.startSearch(deadline, stopSignal=stopEvent)
+    movesMade = len(gs.moveLog)
+    gs.makeMove(move)
+    try:
+        if searcher.algorithm == 'pvs':
+            #negamax from the side that replies, with the window of the root side turned around
+            rootAlpha, rootBeta = ChessAI.toWhiteWindow(alpha, beta, color)
+            value = -color * searcher.pvs(gs, None, depth - 1, -rootBeta, -rootAlpha, -color, ply=1)
+        else:
+            value = searcher.minimax(gs, None, depth - 1, alpha, beta, not maximizingPlayer, ply=1)
+    except ChessAI.SearchTimeout:
+        value = None
+    while len(gs.moveLog) > movesMade:
+        gs.undoMove()
+    if value is not None:
+        with sharedBound.get_lock():
+            if (maximizingPlayer and value > sharedBound.value) or (not maximizingPlayer and value < sharedBound.value):
+                sharedBound.value = value
+    return moveIndex, value, searcher.nodesSearched
+
+
+class ParallelSearcher():
+
+    '''
+    Start numWorkers worker processes (default: one per CPU) searching with algorithm (default:
+    ChessAI.SEARCH_ALGORITHM) on game states of gameStateClass
+    '''
+    def __init__(self, algorithm=None, numWorkers=None, gameStateClass=ChessBitboard.BitboardGameState):
+        self.algorithm = algorithm or ChessAI.SEARCH_ALGORITHM
+        self.searcher = ChessAI.Searcher(self.algorithm) #orders the root moves, and is left the total node count
+        self.bound = mp.Value('d', 0.)
+        self.stopEvent = mp.Event()
+        self.pool = mp.Pool(numWorkers or mp.cpu_count(), initializer=initWorker,
+                            initargs=(gameStateClass, self.algorithm, self.bound, self.stopEvent))
+        #background search, see startSearch
+        self.thread = None
+        self.searchId = 0
+        self.result = None #(search ID, best move ID) of the last finished search
+
+
+    '''
+    Iterative deepening where each iteration is a root split over the worker pool. The first root move of an
+    iteration (the best one of the previous iteration) is searched alone to set a good bound, then the others in
+    parallel. Returns the best move and its score of the last completed iteration. The limits left None are read from
+    ChessAI.DEPTH and ChessAI.TIME_LIMIT
+    '''
+    def search(self, gs, validMoves, maxDepth=None, timeLimit=None):
+        if len(validMoves) == 0:
+            return None, None
+        maxDepth, timeLimit, _ = ChessAI.getLimits(maxDepth, timeLimit)
+        maximizingPlayer = gs.whiteToMove
+        deadline = time.time() + timeLimit if timeLimit is not None else None
+        searcher = self.searcher
+        snapshot = gs.snapshot()
+        rootMoves = list(validMoves)
+        searcher.orderMoves(rootMoves, 0, searcher.transpositionTable.getBestMove(gs.zobristKey))
+        bestMove, bestScore = None, None
+        searcher.nodesSearched = 0
+        bound = self.bound
+        for depth in range(1, maxDepth + 1):
+            bound.value = -np.inf if maximizingPlayer else np.inf
+            tasks = [(i, snapshot, move.moveID, depth, deadline) for i, move in enumerate(rootMoves)]
+            results = [self.pool.apply(searchRootMove, (tasks[0],))]
+            results.extend(self.pool.imap_unordered(searchRootMove, tasks[1:]))
+            searcher.nodesSearched += sum(nodes for _, _, nodes in results)
+            if any(value is None for _, value, _ in results):
+                if bestMove is None: #not even the first iteration finished, take the first move
+                    bestMove = rootMoves[0]
+                break
+            #best score, and the first move in root order among equal scores
+            sign = 1 if maximizingPlayer else -1
+            results.sort(key=lambda result: (-sign * result[1], result[0]))
+            bestMove, bestScore = rootMoves[results[0][0]], results[0][1]
+            #next iteration: best move first, the others by their (possibly bound) scores
+            rootMoves = [rootMoves[i] for i, _, _ in results]
+        return bestMove, bestScore
+
+
+    '''
+    Start searching the current position of gs in a background thread (the work is done by the pool), so the caller
+    is not blocked. The result is collected with getBestMove. The limits as in search
+    '''
+    def startSearch(self, gs, maxDepth=None, timeLimit=None):
+        self.cancel()
+        self.stopEvent.clear()
+        self.searchId += 1
+        #the search runs on its own copy, the caller can go on with gs
+        searchState = ChessBitboard.BitboardGameState.fromSnapshot(gs.snapshot())
+        self.thread = threading.Thread(target=self.runSearch, args=(self.searchId, searchState, maxDepth, timeLimit),
+                                       daemon=True)
+        self.thread.start()
+
+
+    def runSearch(self, searchId, gs, maxDepth, timeLimit):
+        bestMove, _ = self.search(gs, gs.getValidMoves(), maxDepth, timeLimit)
+        self.result = (searchId, bestMove.moveID if bestMove is not None else None)
+
+
+    '''
+    Returns (finished, move) like ChessWorker.SearchWorker.getBestMove
+    '''
+    def getBestMove(self, validMoves):
+        if self.thread is None or self.thread.is_alive():
+            return False, None
+        self.thread = None
+        searchId, moveID = self.result
+        if searchId != self.searchId:
+            return True, None
+        for move in validMoves:
+            if move.moveID == moveID:
+                return True, move
+        return True, None
+
+
+    '''
+    Stop the running search, its result will be ignored
+    '''
+    def cancel(self):
+        if self.thread is not None:
+            self.searchId += 1
+            self.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+
+
+    def close(self):
+        self.cancel()
+        self.pool.terminate()
+        self.pool.join()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+'''
+Same interface as ChessAI.findBestMove, searching with numWorkers processes (default: one per CPU). The limits as
+in ParallelSearcher.search
+'''
+def findBestMoveParallel(gs, validMoves, returnQueue, maxDepth=None, timeLimit=None, numWorkers=None):
+    bestMove, _ = parallelSearch(gs, validMoves, maxDepth, timeLimit, numWorkers)
+    returnQueue.put(bestMove)
+
+
+'''
+One parallel search with a pool started for it. The root moves are ordered with searcher (a new ChessAI.Searcher if
+None), which is also left the total node count of the workers. Returns the best move and its score
+'''
+def parallelSearch(gs, validMoves, maxDepth=None, timeLimit=None, numWorkers=None, searcher=None, algorithm=None):
+    with ParallelSearcher(algorithm or (searcher.algorithm if searcher is not None else None), numWorkers) as parallel:
+        if searcher is not None:
+            parallel.searcher = searcher
+        return parallel.search(gs, validMoves, maxDepth, timeLimit)
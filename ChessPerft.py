@@ -0,0 +1,138 @@
+"""
+Perft (performance test): counts the leaf nodes of the legal move tree of a position up to a given depth.
+The counts are compared with the known ones to validate the move generator, and the time it takes gives a
+throughput benchmark for makeMove/undoMove/getValidMoves.
+
+Usage:
+    python ChessPerft.py --fen "<FEN>" --depth 3 [--divide]
+    python ChessPerft.py --suite [--max-nodes 200000]
+Add --backend legacy to test ChessEngine.GameState instead of ChessBitboard.BitboardGameState.
+"""
+
+import argparse
+import sys
+import time
+
+import ChessEngine
+import ChessBitboard
+
+BACKENDS = {
+    'bitboard': ChessBitboard.BitboardGameState,
+    'legacy': ChessEngine.GameState
+}
+
+#(name, FEN, node counts for depth 1, 2, ...)
+PERFT_SUITE = [
+    ("Start position", ChessEngine.START_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("Position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("Position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+    ("Illegal en passant (horizontal pin)", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", [18, 92, 1670, 10138]),
+    ("Illegal en passant (diagonal pin)", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", [13, 102, 1266, 10276]),
+    ("En passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931]),
+    ("Short castle gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399]),
+    ("Long castle gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", [16, 71, 1286, 7418]),
+    ("Castling rights lost", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826, 1274206]),
+    ("Castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", [44, 1494, 50509, 1720476]),
+    ("Promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", [11, 133, 1442, 19174]),
+    ("Discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", [29, 165, 5160, 31961]),
+    ("Promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", [9, 40, 472, 2661]),
+    ("Underpromote to check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", [6, 27, 273, 1329]),
+    ("Self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", [2, 6, 13, 63]),
+    ("Stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", [10, 25, 268, 926]),
+    ("Double check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", [37, 183, 6559, 23527]),
+]
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+'''
+Perft split by root move. Returns a list of (move, nodes)
+'''
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move, perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+
+'''
+Run perft on a FEN and print the node count, the time and the nodes per second
+'''
+def runPerft(fen, depth, backend='bitboard', showDivide=False):
+    gs = BACKENDS[backend](fen)
+    start = time.time()
+    if showDivide:
+        results = divide(gs, depth)
+        for move, nodes in sorted(results, key=lambda x: x[0].getChessNotation()):
+            print("{}: {}".format(move.getChessNotation(), nodes))
+        nodes = sum(n for _, n in results)
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.time() - start
+    print("Nodes: {}  Time: {:.2f}s  NPS: {:.0f}".format(nodes, elapsed, nodes / elapsed if elapsed > 0 else 0))
+    return nodes
+
+
+'''
+Run every position of the suite, up to the deepest known depth with at most maxNodes nodes.
+Returns True if all the counts match
+'''
+def runSuite(backend='bitboard', maxNodes=200000):
+    allPassed = True
+    totalNodes = 0
+    start = time.time()
+    for name, fen, counts in PERFT_SUITE:
+        depth = 1
+        while depth < len(counts) and counts[depth] <= maxNodes:
+            depth += 1
+        gs = BACKENDS[backend](fen)
+        positionStart = time.time()
+        nodes = perft(gs, depth)
+        elapsed = time.time() - positionStart
+        passed = nodes == counts[depth - 1]
+        allPassed = allPassed and passed
+        totalNodes += nodes
+        print("{:5} {:40} depth {}  nodes {:9} expected {:9}  {:.2f}s".format(
+            "OK" if passed else "FAIL", name, depth, nodes, counts[depth - 1], elapsed))
+    elapsed = time.time() - start
+    print("{}  Total nodes: {}  Time: {:.2f}s  NPS: {:.0f}".format(
+        "All passed" if allPassed else "FAILED", totalNodes, elapsed, totalNodes / elapsed if elapsed > 0 else 0))
+    return allPassed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft move generator validation and benchmark")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the node count of each root move")
+    parser.add_argument("--suite", action="store_true", help="run the built-in suite of positions")
+    parser.add_argument("--max-nodes", type=int, default=200000, help="node budget per suite position")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default='bitboard')
+    args = parser.parse_args()
+    if args.suite:
+        return 0 if runSuite(args.backend, args.max_nodes) else 1
+    runPerft(args.fen, args.depth, args.backend, args.divide)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Statistics of an AI search, to find out where the time goes: node counts (quiescence included), nodes per second,
+how often and how early the moves cause cutoffs, transposition table hits, time spent generating moves and
+evaluating positions, and the score and principal variation of every completed iteration.
+
+A SearchStats is filled in by ChessAI during the search and turned into a dict or a JSON line at the end.
+profileCall runs a search (or anything else) under cProfile or tracemalloc.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+
+PROFILERS = ('cprofile', 'tracemalloc')
+
+
+class SearchStats():
+
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.elapsed = 0.
+        self.depth = 0 #last completed iteration
+        self.nodes = 0 #quiescence nodes included
+        self.quiescenceNodes = 0
+        self.expandedNodes = 0 #nodes whose moves were searched
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0 #cutoffs caused by the first move searched
+        self.ttHits = 0
+        self.ttProbes = 0
+        self.generationTime = 0. #seconds spent generating (and ordering) moves
+        self.evaluationTime = 0. #seconds spent evaluating positions
+        self.iterations = [] #one dict per completed iteration
+
+
+    '''
+    Record a completed iteration. pv is the list of its moves
+    '''
+    def recordIteration(self, depth, score, nodes, quiescenceNodes, pv):
+        self.depth = depth
+        self.iterations.append({
+            "depth": depth,
+            "score": score,
+            "nodes": nodes,
+            "quiescenceNodes": quiescenceNodes,
+            "time": round(time.perf_counter() - self.startTime, 4),
+            "pv": [move.getChessNotation() for move in pv]
+        })
+
+
+    '''
+    Record the totals at the end of the search. ttStats comes from TranspositionTable.getStats
+    '''
+    def finish(self, nodes, quiescenceNodes, ttStats):
+        self.elapsed = time.perf_counter() - self.startTime
+        self.nodes = nodes
+        self.quiescenceNodes = quiescenceNodes
+        self.ttHits = ttStats["hits"]
+        self.ttProbes = ttStats["hits"] + ttStats["misses"]
+
+
+    def toDict(self):
+        return {
+            "depth": self.depth,
+            "time": round(self.elapsed, 4),
+            "nodes": self.nodes,
+            "quiescenceNodes": self.quiescenceNodes,
+            "nps": round(self.nodes / self.elapsed) if self.elapsed > 0 else 0,
+            "cutoffRate": round(self.cutoffs / self.expandedNodes, 4) if self.expandedNodes else 0.,
+            "firstMoveCutoffRate": round(self.firstMoveCutoffs / self.cutoffs, 4) if self.cutoffs else 0.,
+            "ttHitRate": round(self.ttHits / self.ttProbes, 4) if self.ttProbes else 0.,
+            "generationTime": round(self.generationTime, 4),
+            "evaluationTime": round(self.evaluationTime, 4),
+            "iterations": self.iterations
+        }
+
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+
+'''
+Append a dict of statistics (SearchStats.toDict) to a file as one JSON line
+'''
+def writeJsonLine(path, stats):
+    with open(path, 'a') as f:
+        f.write(json.dumps(stats) + "\n")
+
+
+'''
+Call function(*args, **kwargs) under the profiler ('cprofile' or 'tracemalloc', None for no profiling), print the
+top entries of the report to stream and return what the function returned
+'''
+def profileCall(profiler, function, *args, top=20, stream=None, **kwargs):
+    stream = stream or sys.stdout
+    if profiler is None:
+        return function(*args, **kwargs)
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        result = profile.runcall(function, *args, **kwargs)
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(top)
+        stream.write(report.getvalue())
+        return result
+    if profiler == 'tracemalloc':
+        tracingBefore = tracemalloc.is_tracing()
+        if not tracingBefore:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = function(*args, **kwargs)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracingBefore:
+            tracemalloc.stop()
+        stream.write("Memory: current {:.1f} KiB, peak {:.1f} KiB\n".format(current / 1024, peak / 1024))
+        for stat in after.compare_to(before, 'lineno')[:top]:
+            stream.write(str(stat) + "\n")
+        return result
+    raise ValueError("Unknown profiler {}, expected one of {}".format(profiler, PROFILERS))
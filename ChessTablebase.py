@@ -0,0 +1,131 @@
+"""
+Endgame tablebase probing: with few pieces left, the Syzygy tablebases tell whether the side to move wins, draws or
+loses (WDL tables) and how far the next capture or pawn move of the best play is (DTZ tables), where the search would
+only see material.
+
+The tables are read from local files (e.g. KQvK.rtbw, KQvK.rtbz) by python-chess, which memory-maps them. python-chess
+is optional: without it Tablebase can't be created and ChessAI plays without tablebases. The WDL results of recent
+probes are kept in a small LRU cache, since the search probes the same positions again and again and every probe
+decompresses a block of the table.
+"""
+
+import collections
+import os
+
+try:
+    import chess
+    import chess.syzygy
+except ImportError: #python-chess is optional
+    chess = None
+
+CACHE_SIZE = 65536 #WDL results kept in memory
+#WDL values, from the point of view of the side to move. A cursed win (blessed loss) is a win (loss) that the
+#fifty-move rule turns into a draw
+LOSS = -2
+BLESSED_LOSS = -1
+DRAW = 0
+CURSED_WIN = 1
+WIN = 2
+FIFTY_MOVE_PLIES = 100 #half moves without a capture or pawn move before the game is drawn
+
+
+class Tablebase():
+
+    '''
+    Tables from the Syzygy files in directory. Only positions with at most maxPieces pieces (kings included) are probed,
+    and never more than the largest table found
+    '''
+    def __init__(self, directory, maxPieces=None, cacheSize=CACHE_SIZE):
+        if chess is None:
+            raise ImportError("Tablebase probing needs python-chess (pip install chess)")
+        self.tablebase = chess.syzygy.Tablebase()
+        self.tablebase.add_directory(directory)
+        largest = max((len(name.split('.')[0]) - 1 for name in os.listdir(directory) if name.endswith('.rtbw')),
+                      default=0)
+        self.maxPieces = largest if maxPieces is None else min(maxPieces, largest)
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict() #zobrist key -> WDL (None if the position is not in the tables)
+        self.hits = 0
+        self.probes = 0
+
+
+    def close(self):
+        self.tablebase.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    '''
+    True if the position of gs may be in the tables: few enough pieces and no castling rights
+    '''
+    def canProbe(self, gs):
+        return gs.pieceCount <= self.maxPieces and gs.castlingRights == 0
+
+
+    '''
+    WDL of the position of gs for the side to move (LOSS to WIN), None if it is not in the tables. As in the tables,
+    the position is taken as just reached by a capture or pawn move: the fifty-move counter is not taken into account
+    '''
+    def probeWDL(self, gs):
+        if not self.canProbe(gs):
+            return None
+        key = gs.zobristKey
+        self.probes += 1
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        try:
+            wdl = self.tablebase.probe_wdl(chess.Board(gs.getFen()))
+        except KeyError: #missing table
+            wdl = None
+        self.cache[key] = wdl
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return wdl
+
+
+    '''
+    DTZ of the position of gs for the side to move, None if it is not in the tables: positive when winning, negative
+    when losing, the number of half moves to the next capture or pawn move with the best play (0 for a draw)
+    '''
+    def probeDTZ(self, gs):
+        if not self.canProbe(gs):
+            return None
+        try:
+            return self.tablebase.probe_dtz(chess.Board(gs.getFen()))
+        except KeyError:
+            return None
+
+
+    '''
+    The move of validMoves that keeps the best result, the fastest win (or slowest loss) by DTZ among those. The
+    fifty-move rule is taken into account: a win (loss) that can't reach the next capture or pawn move within the half
+    moves left by gs.halfmoveClock is a draw, as are the cursed wins and blessed losses.
+    None if a position after a move is not in the tables
+    '''
+    def getBestMove(self, gs, validMoves):
+        bestMove, bestKey = None, None
+        for move in validMoves:
+            gs.makeMove(move)
+            wdl = self.probeWDL(gs)
+            dtz = self.probeDTZ(gs) if wdl is not None else None
+            halfmoveClock = gs.halfmoveClock
+            gs.undoMove()
+            if dtz is None:
+                return None
+            #the child is seen from the opponent: its loss is our win
+            result = -wdl
+            if result in (CURSED_WIN, BLESSED_LOSS) or halfmoveClock + abs(dtz) > FIFTY_MOVE_PLIES:
+                result = DRAW
+            #win fast (small |dtz|), lose slowly, draws are all the same
+            key = (result, -abs(dtz) if result > 0 else abs(dtz) if result < 0 else 0)
+            if bestKey is None or key > bestKey:
+                bestMove, bestKey = move, key
+        return bestMove
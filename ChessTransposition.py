@@ -0,0 +1,133 @@
+"""
+Fixed size transposition table used by the search to remember the results of positions it has already searched.
+Positions are identified by their zobrist key (see ChessEngine.GameState.zobristKey).
+
+The table is made of buckets of two entries: the first one is depth-preferred (it is only replaced by a search of
+the same or greater depth, or by the same position), the second one is always replaced. All the storage is allocated
+up front, so the memory used stays the same however long the table is used.
+"""
+
+EXACT = 0
+LOWERBOUND = 1 #the score is at least the stored one (the search failed high)
+UPPERBOUND = 2 #the score is at most the stored one (the search failed low)
+
+#Rough memory cost of one entry: five list slots plus the key and score objects they point to
+ENTRY_BYTES = 96
+
+
+class TranspositionTable():
+
+    def __init__(self, sizeMB=16):
+        numEntries = max(2, int(sizeMB * 1024 * 1024) // ENTRY_BYTES)
+        numBuckets = 1
+        while numBuckets * 4 <= numEntries: #largest power of two such that 2 * numBuckets <= numEntries
+            numBuckets *= 2
+        self.sizeMB = sizeMB
+        self.numBuckets = numBuckets
+        self.bucketMask = numBuckets - 1
+        self.numEntries = 2 * numBuckets
+        self.keys = [None] * self.numEntries
+        self.depths = [-1] * self.numEntries
+        self.scores = [0] * self.numEntries
+        self.flags = [EXACT] * self.numEntries
+        self.bestMoves = [None] * self.numEntries
+        self.resetStats()
+
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0 #a different position was thrown away to make room
+
+
+    def clear(self):
+        for i in range(self.numEntries):
+            self.keys[i] = None
+            self.depths[i] = -1
+            self.bestMoves[i] = None
+        self.resetStats()
+
+
+    '''
+    Look up a position. Returns (depth, score, flag, bestMove) or None if the position is not stored
+    '''
+    def probe(self, key):
+        i = (key & self.bucketMask) << 1
+        if self.keys[i] != key:
+            i += 1
+            if self.keys[i] != key:
+                self.misses += 1
+                return None
+        self.hits += 1
+        return (self.depths[i], self.scores[i], self.flags[i], self.bestMoves[i])
+
+
+    '''
+    Best move stored for a position, without counting it as a probe
+    '''
+    def getBestMove(self, key):
+        i = (key & self.bucketMask) << 1
+        if self.keys[i] == key:
+            return self.bestMoves[i]
+        if self.keys[i + 1] == key:
+            return self.bestMoves[i + 1]
+        return None
+
+
+    '''
+    Store the result of a search of the given depth. bestMove is a move ID (or None). A position is never stored
+    twice in its bucket: if it is in the always-replace entry and now deep enough for the depth-preferred one, it moves
+    there and the position it displaces goes to the always-replace entry
+    '''
+    def store(self, key, depth, score, flag, bestMove):
+        i = (key & self.bucketMask) << 1
+        if self.keys[i] != key:
+            if self.keys[i + 1] == key and depth >= self.depths[i]:
+                if bestMove is None:
+                    bestMove = self.bestMoves[i + 1]
+                self.moveEntry(i, i + 1)
+                self.keys[i] = None #nothing is thrown away, the entry is free for the position
+            elif self.keys[i + 1] == key or depth < self.depths[i]:
+                i += 1 #the depth-preferred entry is deeper, use the always-replace one
+        if self.keys[i] is not None and self.keys[i] != key:
+            self.overwrites += 1
+        elif self.keys[i] == key and bestMove is None:
+            bestMove = self.bestMoves[i] #keep the old best move, it is still a good first guess
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.scores[i] = score
+        self.flags[i] = flag
+        self.bestMoves[i] = bestMove
+        self.stores += 1
+
+
+    '''
+    Copy the entry in source over the one in destination
+    '''
+    def moveEntry(self, source, destination):
+        self.keys[destination] = self.keys[source]
+        self.depths[destination] = self.depths[source]
+        self.scores[destination] = self.scores[source]
+        self.flags[destination] = self.flags[source]
+        self.bestMoves[destination] = self.bestMoves[source]
+
+
+    '''
+    Fraction of the entries in use
+    '''
+    def getFillRate(self):
+        return sum(1 for key in self.keys if key is not None) / self.numEntries
+
+
+    def getStats(self):
+        probes = self.hits + self.misses
+        return {
+            "sizeMB": self.sizeMB,
+            "entries": self.numEntries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / probes if probes else 0.,
+            "stores": self.stores,
+            "overwrites": self.overwrites
+        }
@@ -0,0 +1,134 @@
+"""
+Long-lived AI search worker. Instead of starting a process and pickling the whole game state for every AI move, a
+single worker process is started once and fed compact position descriptions: the FEN the game started from plus the
+moves played since, as move IDs (see ChessEngine.Move.fromID). The worker keeps its own game state (only playing or taking back the
+moves that changed since the previous search) and its transposition table, so both stay warm from move to move.
+
+A running search is cancelled by changing the ID of the active search, shared with the worker and checked by the
+search (see ChessAI.Searcher.stopSignal), so the process never needs to be terminated.
+"""
+
+import multiprocessing as mp
+import queue
+
+import ChessAI
+import ChessBitboard
+from ChessEngine import Move
+
+
+class SearchWorker():
+
+    def __init__(self, gameStateClass=ChessBitboard.BitboardGameState):
+        self.commandQueue = mp.Queue()
+        self.resultQueue = mp.Queue()
+        self.activeSearchId = mp.Value('i', 0)
+        self.searchId = 0
+        self.searching = False
+        self.searchStats = None #statistics of the last finished search, see ChessSearchStats.SearchStats.toDict
+        self.process = mp.Process(target=workerLoop, args=(self.commandQueue, self.resultQueue, self.activeSearchId,
+                                                           gameStateClass), daemon=True)
+        self.process.start()
+
+
+    '''
+    Start searching the current position of gs. The result is collected with getBestMove. The limits left None are
+    resolved by the Searcher of the worker (ChessAI.DEPTH, TIME_LIMIT, NODE_LIMIT) when the search starts
+    '''
+    def startSearch(self, gs, maxDepth=None, timeLimit=None, nodeLimit=None):
+        self.searchId += 1
+        self.activeSearchId.value = self.searchId
+        moves = [move.moveID for move in gs.moveLog]
+        self.commandQueue.put(('search', self.searchId, gs.startFen, moves, maxDepth, timeLimit, nodeLimit))
+        self.searching = True
+
+
+    '''
+    Returns (finished, move). While the search is running finished is False. When it is done, move is the move of
+    validMoves chosen by the AI, or None if it did not find one
+    '''
+    def getBestMove(self, validMoves):
+        try:
+            while True:
+                searchId, moveID, searchStats = self.resultQueue.get_nowait()
+                if searchId == self.searchId: #results of cancelled searches are dropped
+                    break
+        except queue.Empty:
+            return False, None
+        self.searching = False
+        self.searchStats = searchStats
+        for move in validMoves:
+            if move.moveID == moveID:
+                return True, move
+        return True, None
+
+
+    '''
+    Stop the running search, its result will be ignored
+    '''
+    def cancel(self):
+        if self.searching:
+            self.searchId += 1
+            self.activeSearchId.value = self.searchId
+            self.searching = False
+
+
+    def close(self):
+        self.cancel()
+        self.commandQueue.put(('quit',))
+        self.process.join(timeout=1)
+
+
+'''
+Stop signal of one search: it is set once another search became the active one
+'''
+class StopSignal():
+
+    def __init__(self, activeSearchId, searchId):
+        self.activeSearchId = activeSearchId
+        self.searchId = searchId
+
+    def is_set(self):
+        return self.activeSearchId.value != self.searchId
+
+
+'''
+Bring the worker game state to the position described by fen and moves, reusing the current one when the game is
+the same: the moves in common are kept, the others are taken back or played
+'''
+def updatePosition(gs, gameStateClass, fen, moves):
+    if gs is None or gs.startFen != fen:
+        gs = gameStateClass(fen)
+    playedMoves = [move.moveID for move in gs.moveLog]
+    common = 0
+    while common < min(len(playedMoves), len(moves)) and playedMoves[common] == moves[common]:
+        common += 1
+    for _ in range(len(playedMoves) - common):
+        gs.undoMove()
+    for moveID in moves[common:]:
+        gs.makeMove(Move.fromID(moveID, gs.board))
+    return gs
+
+
+def workerLoop(commandQueue, resultQueue, activeSearchId, gameStateClass):
+    gs = None
+    searcher = ChessAI.Searcher()
+    while True:
+        try:
+            command = commandQueue.get(timeout=1)
+        except queue.Empty:
+            if not mp.parent_process().is_alive(): #the game was closed without stopping the worker
+                break
+            continue
+        if command[0] == 'quit':
+            break
+        _, searchId, fen, moves, maxDepth, timeLimit, nodeLimit = command
+        stopSignal = StopSignal(activeSearchId, searchId)
+        if stopSignal.is_set(): #cancelled before it started
+            continue
+        gs = updatePosition(gs, gameStateClass, fen, moves)
+        validMoves = gs.getValidMoves()
+        bestMove = None
+        if len(validMoves) > 0:
+            bestMove = searcher.searchBestMove(gs, validMoves, maxDepth, timeLimit, nodeLimit, stopSignal)
+        resultQueue.put((searchId, bestMove.moveID if bestMove is not None else None,
+                         searcher.searchStats.toDict() if bestMove is not None else None))
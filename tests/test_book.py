@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+import ChessBitboard
+import ChessEngine
+from ChessBook import ENTRY_FORMAT, OpeningBook, getPolyglotKey
+
+BACKENDS = (ChessEngine.GameState, ChessBitboard.BitboardGameState)
+
+#the test positions of the Polyglot format description: the moves from the start position and the key reached
+POLYGLOT_KEYS = [
+    ("", 0x463B96181691FC9C),
+    ("e2e4", 0x823C9B50FD114196),
+    ("e2e4 d7d5", 0x0756B94461C50FB0),
+    ("e2e4 d7d5 e4e5", 0x662FAFB965DB29D4),
+    ("e2e4 d7d5 e4e5 f7f5", 0x22A48B5A8E47FF78),
+    ("e2e4 d7d5 e4e5 f7f5 e1e2", 0x652A607CA3F242C1),
+    ("e2e4 d7d5 e4e5 f7f5 e1e2 e8f7", 0x00FDD303C946BDD9),
+    ("a2a4 b7b5 h2h4 b5b4 c2c4", 0x3C8123EA7B067637),
+    ("a2a4 b7b5 h2h4 b5b4 c2c4 b4c3 a1a3", 0x5C3F9B829B279560),
+]
+
+
+def makeMoves(gs, notations):
+    for notation in notations.split():
+        gs.makeMove(next(move for move in gs.getValidMoves() if move.getChessNotation() == notation))
+
+
+'''
+A book move as stored in a Polyglot book, from squares like "e2"
+'''
+def encodeBookMove(start, end, promotion=0):
+    def square(name):
+        return (int(name[1]) - 1) * 8 + "abcdefgh".index(name[0])
+    return square(end) | square(start) << 6 | promotion << 12
+
+
+def writeBook(path, entries):
+    with open(path, 'wb') as f:
+        for key, bookMove, weight in sorted(entries):
+            f.write(ENTRY_FORMAT.pack(key, bookMove, weight, 0))
+    return str(path)
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+@pytest.mark.parametrize("moves, key", POLYGLOT_KEYS)
+def testPolyglotKey(gameStateClass, moves, key):
+    gs = gameStateClass()
+    makeMoves(gs, moves)
+    assert getPolyglotKey(gs) == key
+
+
+def testBookLookup(tmp_path):
+    startKey = POLYGLOT_KEYS[0][1]
+    castleFen = "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"
+    promotionFen = "8/1P2k3/8/8/8/8/8/4K3 w - - 0 1"
+    castleKey = getPolyglotKey(ChessEngine.GameState(castleFen))
+    promotionKey = getPolyglotKey(ChessEngine.GameState(promotionFen))
+    entries = [
+        (startKey, encodeBookMove("e2", "e4"), 10),
+        (startKey, encodeBookMove("d2", "d4"), 5),
+        (startKey, encodeBookMove("g1", "f3"), 0), #never chosen
+        (startKey, encodeBookMove("e2", "e5"), 7), #not legal, left out
+        (castleKey, encodeBookMove("e1", "h1"), 1), #castling is stored as the king taking its rook
+        (promotionKey, encodeBookMove("b7", "b8", 1), 1), #underpromotion to a knight
+    ]
+    #other positions before and after, for the binary search
+    entries += [(random.Random(i).getrandbits(64), encodeBookMove("a2", "a3"), 1) for i in range(200)]
+    with OpeningBook(writeBook(tmp_path / "book.bin", entries)) as book:
+        assert book.numEntries == len(entries)
+        gs = ChessBitboard.BitboardGameState()
+        moves = [(move.getChessNotation(), weight) for move, weight in book.getMoves(gs)]
+        assert sorted(moves) == [("d2d4", 5), ("e2e4", 10), ("g1f3", 0)]
+        assert book.chooseMove(gs, best=True).getChessNotation() == "e2e4"
+        for seed in range(20):
+            assert book.chooseMove(gs, rng=random.Random(seed)).getChessNotation() in ("e2e4", "d2d4")
+
+        move = book.chooseMove(ChessBitboard.BitboardGameState(castleFen))
+        assert move.isCastleMove and move.getChessNotation() == "e1g1"
+        move = book.chooseMove(ChessBitboard.BitboardGameState(promotionFen))
+        assert move.isPawnPromotion and move.promotionPiece == 'N'
+
+        gs = ChessBitboard.BitboardGameState()
+        makeMoves(gs, "e2e4")
+        assert book.getMoves(gs) == []
+        assert book.chooseMove(gs) is None
+
+
+def testEmptyBook(tmp_path):
+    with OpeningBook(writeBook(tmp_path / "empty.bin", [])) as book:
+        assert book.numEntries == 0
+        assert book.chooseMove(ChessEngine.GameState()) is None
@@ -0,0 +1,163 @@
+import random
+
+import pytest
+
+import ChessBitboard
+import ChessEngine
+import ChessPerft
+
+BACKENDS = (ChessEngine.GameState, ChessBitboard.BitboardGameState)
+
+
+'''
+The game state along random games from the perft suite positions, after each move
+'''
+def iterRandomPositions(gameStateClass, seed, games=2, plies=60):
+    rng = random.Random(seed)
+    for _, fen, _ in ChessPerft.PERFT_SUITE:
+        for _ in range(games):
+            gs = gameStateClass(fen)
+            yield gs
+            for _ in range(plies):
+                moves = gs.getValidMoves()
+                if not moves:
+                    break
+                gs.makeMove(rng.choice(moves))
+                yield gs
+
+
+def makeMoves(gs, notations):
+    for notation in notations.split():
+        gs.makeMove(next(move for move in gs.getValidMoves() if move.getChessNotation() == notation))
+
+
+'''
+The zobrist key kept up to date by makeMove, makeNullMove and undoMove is the key computed from scratch, along random
+games from the perft suite positions that go through castling, en-passant, promotions and null moves
+'''
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testIncrementalZobristKey(gameStateClass):
+    rng = random.Random(1)
+    seen = set()
+    for _, fen, _ in ChessPerft.PERFT_SUITE:
+        for _ in range(4):
+            gs = gameStateClass(fen)
+            keys = [gs.zobristKey]
+            for _ in range(80):
+                moves = gs.getValidMoves()
+                if not moves:
+                    break
+                if rng.random() < 0.1 and not gs.isKingInCheck() and (not gs.moveLog or gs.moveLog[-1] is not None):
+                    gs.makeNullMove()
+                    seen.add("null")
+                else:
+                    #prefer the special moves, so that each game has some
+                    special = [move for move in moves if move.isCastleMove or move.isEnpassantMove or move.isPawnPromotion]
+                    move = rng.choice(special if special and rng.random() < 0.5 else moves)
+                    gs.makeMove(move)
+                    seen.update(kind for kind, flag in (("castle", move.isCastleMove), ("enpassant", move.isEnpassantMove),
+                                                        ("promotion", move.isPawnPromotion)) if flag)
+                assert gs.zobristKey == gs.computeZobristKey()
+                keys.append(gs.zobristKey)
+            while gs.moveLog:
+                gs.undoMove()
+                keys.pop()
+                assert gs.zobristKey == keys[-1] == gs.computeZobristKey()
+    assert seen == {"null", "castle", "enpassant", "promotion"}
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testFenRoundTrip(gameStateClass):
+    for gs in iterRandomPositions(gameStateClass, 2):
+        fen = gs.getFen()
+        copy = gameStateClass(fen)
+        assert copy.getFen() == fen
+        assert copy.board == gs.board
+        assert copy.zobristKey == gs.zobristKey
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testEncodePositionRoundTrip(gameStateClass):
+    copy = gameStateClass()
+    for gs in iterRandomPositions(gameStateClass, 3):
+        data = gs.encodePosition()
+        assert len(data) == ChessEngine.POSITION_BYTES == 30
+        assert ChessEngine.decodePosition(data) == gs.getFen()
+        copy.loadPosition(data)
+        assert copy.getFen() == gs.getFen()
+        assert copy.zobristKey == gs.zobristKey
+        assert sorted(move.moveID for move in copy.getValidMoves()) == sorted(move.moveID for move in gs.getValidMoves())
+
+
+def testInvalidFen():
+    with pytest.raises(ValueError):
+        ChessEngine.GameState("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1")
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testSnapshotRoundTrip(gameStateClass):
+    for gs in iterRandomPositions(gameStateClass, 4, games=1):
+        for copyClass in BACKENDS:
+            copy = copyClass.fromSnapshot(gs.snapshot())
+            assert copy.getFen() == gs.getFen()
+            assert copy.zobristKey == gs.zobristKey
+            assert copy.moveLog == []
+            assert copy.countRepetitions() == gs.countRepetitions()
+
+
+'''
+A snapshot keeps the positions a repetition can come from, so a copy sees the repetitions of the game
+'''
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testSnapshotKeepsTheRepetitions(gameStateClass):
+    gs = gameStateClass()
+    makeMoves(gs, "e2e4 e7e5 g1f3 b8c6 f3g1 c6b8")
+    copy = gameStateClass.fromSnapshot(gs.snapshot())
+    assert len(copy.priorKeys) == 4
+    assert copy.countRepetitions() == 1
+    assert not copy.isDraw()
+    makeMoves(copy, "g1f3 b8c6 f3g1 c6b8")
+    assert copy.isDraw()
+    with pytest.raises(ValueError):
+        gameStateClass.fromSnapshot(gs.snapshot()[:-1])
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testThreefoldRepetition(gameStateClass):
+    gs = gameStateClass()
+    makeMoves(gs, "g1f3 g8f6 f3g1 f6g8")
+    assert gs.countRepetitions() == 1
+    assert gs.isDraw(1) and not gs.isDraw()
+    makeMoves(gs, "g1f3 g8f6 f3g1 f6g8")
+    assert gs.countRepetitions() == 2
+    assert gs.isDraw()
+    gs.undoMove()
+    assert not gs.isDraw()
+
+
+'''
+A capture or pawn move, or a null move, stands between the position and the earlier ones: no repetition through it
+'''
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testNoRepetitionAcrossIrreversibleMoves(gameStateClass):
+    gs = gameStateClass()
+    makeMoves(gs, "g1f3 g8f6 f3g1 f6g8 e2e3 e7e6 g1f3 g8f6 f3g1 f6g8")
+    assert gs.countRepetitions() == 1
+    gs = gameStateClass()
+    makeMoves(gs, "g1f3 g8f6")
+    gs.makeNullMove()
+    gs.makeNullMove()
+    makeMoves(gs, "f3g1 f6g8 g1f3 g8f6")
+    assert gs.countRepetitions() == 1 #the position before the null moves is not counted
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+def testFiftyMoveRule(gameStateClass):
+    gs = gameStateClass("8/8/4k3/8/8/3K4/4P3/8 w - - 98 70")
+    makeMoves(gs, "d3d4")
+    assert gs.halfmoveClock == 99 and not gs.isDraw()
+    makeMoves(gs, "e6d6")
+    assert gs.halfmoveClock == 100 and gs.isDraw()
+    gs.undoMove()
+    makeMoves(gs, "e6f5 e2e4")
+    assert gs.halfmoveClock == 0 and not gs.isDraw()
@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+import pytest
+
+import ChessAI
+import ChessBitboard
+import ChessPerft
+
+
+'''
+The perft suite positions and the positions along a random game from each
+'''
+def getPositions():
+    rng = random.Random(5)
+    positions = []
+    for _, fen, _ in ChessPerft.PERFT_SUITE:
+        gs = ChessBitboard.BitboardGameState(fen)
+        positions.append(gs.getFen())
+        for _ in range(30):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+            positions.append(gs.getFen())
+    return [ChessBitboard.BitboardGameState(fen) for fen in positions]
+
+
+def testEvaluateBatchMatchesEvaluate():
+    positions = getPositions()
+    codes = ChessAI.encodeBoards([gs.board for gs in positions])
+    assert codes.shape == (len(positions), 64)
+    expected = [ChessAI.evaluate(gs) for gs in positions]
+    assert ChessAI.evaluateBatch(codes) == pytest.approx(expected, abs=1e-9)
+    #the same positions as piece planes
+    planes = np.zeros((len(positions), 12, 64))
+    for i in range(12):
+        planes[:, i, :] = codes == i + 1
+    assert ChessAI.evaluateBatch(planes) == pytest.approx(expected, abs=1e-9)
+
+
+def testEvaluateBatchMatchesIncrementalEvaluate():
+    for gs in getPositions():
+        gs.enableIncrementalEval(ChessAI.pieceMaterialTable, ChessAI.piecePositionTable)
+        moves = gs.getValidMoves()
+        expected = []
+        for move in moves:
+            gs.makeMove(move)
+            expected.append(ChessAI.evaluate(gs))
+            gs.undoMove()
+        assert ChessAI.evaluateMoves(gs, moves) == pytest.approx(expected, abs=1e-9)
+
+
+def testEvaluateBatchRejectsOtherShapes():
+    with pytest.raises(ValueError):
+        ChessAI.evaluateBatch(np.zeros((2, 8, 8), dtype=np.int8))
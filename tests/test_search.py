@@ -0,0 +1,68 @@
+import pytest
+
+import ChessAI
+import ChessBitboard
+import ChessEngine
+
+BACKENDS = (ChessEngine.GameState, ChessBitboard.BitboardGameState)
+
+
+'''
+Queen takes c7: a stalemate, which must not be scored as a win
+'''
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+@pytest.mark.parametrize("algorithm", ChessAI.SEARCH_ALGORITHMS)
+def testStalemateIsNotAWin(gameStateClass, algorithm):
+    for depth in (2, 3):
+        gs = gameStateClass("k7/8/8/1K6/8/8/8/2Q5 w - - 0 1")
+        searcher = ChessAI.Searcher(algorithm)
+        move = searcher.searchBestMove(gs, gs.getValidMoves(), depth)
+        assert move.getChessNotation() != "c1c7"
+        assert abs(searcher.searchScore) < ChessAI.CHECKMATE / 2
+
+
+@pytest.mark.parametrize("gameStateClass", BACKENDS)
+@pytest.mark.parametrize("algorithm", ChessAI.SEARCH_ALGORITHMS)
+def testMateInOne(gameStateClass, algorithm):
+    gs = gameStateClass("k7/8/1K6/8/8/8/8/2Q5 w - - 0 1")
+    searcher = ChessAI.Searcher(algorithm)
+    move = searcher.searchBestMove(gs, gs.getValidMoves(), 3)
+    assert move.getChessNotation() == "c1c8"
+    assert searcher.searchScore == ChessAI.CHECKMATE - 1
+
+
+'''
+A mate found closer to the root scores higher, for black too
+'''
+@pytest.mark.parametrize("algorithm", ChessAI.SEARCH_ALGORITHMS)
+def testMateScoresCountThePly(algorithm):
+    gs = ChessBitboard.BitboardGameState("K7/8/1k6/8/8/8/8/2q5 b - - 0 1")
+    searcher = ChessAI.Searcher(algorithm)
+    move = searcher.searchBestMove(gs, gs.getValidMoves(), 3)
+    assert move.getChessNotation() == "c1c8"
+    assert searcher.searchScore == -(ChessAI.CHECKMATE - 1)
+
+
+'''
+Mate scores in the transposition table count from the position, not from the root of the search that stored them:
+once the first move of a mate in two is played, a search with the same table sees a mate in one less move
+'''
+@pytest.mark.parametrize("algorithm", ChessAI.SEARCH_ALGORITHMS)
+def testMateScoresFromTheTableCountThePly(algorithm):
+    gs = ChessBitboard.BitboardGameState("k7/8/2K5/8/8/8/8/1R6 w - - 0 1")
+    searcher = ChessAI.Searcher(algorithm)
+    gs.makeMove(searcher.searchBestMove(gs, gs.getValidMoves(), 4))
+    assert searcher.searchScore == ChessAI.CHECKMATE - 3
+    gs.makeMove(searcher.searchBestMove(gs, gs.getValidMoves(), 3))
+    assert searcher.searchScore == ChessAI.CHECKMATE - 2
+    searcher.searchBestMove(gs, gs.getValidMoves(), 4)
+    assert searcher.searchScore == ChessAI.CHECKMATE - 1
+
+
+def testTableScoresRelativeToThePosition():
+    for score in (ChessAI.CHECKMATE - 5, ChessAI.TABLEBASE_WIN - 5):
+        assert ChessAI.toTableScore(score, 3) == score + 3
+        assert ChessAI.toTableScore(-score, 3) == -score - 3
+        assert ChessAI.fromTableScore(ChessAI.toTableScore(score, 3), 1) == score + 2
+        assert ChessAI.fromTableScore(ChessAI.toTableScore(-score, 3), 1) == -score - 2
+    assert ChessAI.toTableScore(2.5, 3) == 2.5
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+chess = pytest.importorskip("chess")
+
+import ChessAI
+import ChessBitboard
+from ChessTablebase import Tablebase
+
+SYZYGY_PATH = os.environ.get("SYZYGY_PATH") #directory with at least the KQvK tables, for the tests on real files
+
+
+'''
+Stands in for chess.syzygy.Tablebase: results for the side to move given by a function of the python-chess board
+'''
+class FakeTables():
+
+    def __init__(self, results):
+        self.results = results
+
+    def probe_wdl(self, board):
+        return self.results(board)[0]
+
+    def probe_dtz(self, board):
+        return self.results(board)[1]
+
+    def close(self):
+        pass
+
+
+'''
+KQvK: the side with the queen wins, the mated side has lost
+'''
+def queenWins(board):
+    if board.is_checkmate():
+        return -2, 0
+    hasQueen = any(piece.piece_type == chess.QUEEN and piece.color == board.turn for piece in board.piece_map().values())
+    return (2, 10) if hasQueen else (-2, -10)
+
+
+def makeTablebase(tmp_path, results):
+    (tmp_path / "KQvK.rtbw").touch()
+    tablebase = Tablebase(str(tmp_path))
+    tablebase.tablebase = FakeTables(results)
+    return tablebase
+
+
+def findMove(moves, notation):
+    return next(move for move in moves if move.getChessNotation() == notation)
+
+
+def testMaxPiecesFromTheFiles(tmp_path):
+    assert Tablebase(str(tmp_path)).maxPieces == 0
+    (tmp_path / "KRvKN.rtbw").touch()
+    assert Tablebase(str(tmp_path)).maxPieces == 4
+    assert Tablebase(str(tmp_path), 3).maxPieces == 3
+
+
+def testRootPlaysTheMate(tmp_path):
+    tablebase = makeTablebase(tmp_path, queenWins)
+    gs = ChessBitboard.BitboardGameState("k7/8/1K6/8/8/8/8/2Q5 w - - 0 1")
+    assert tablebase.probeWDL(gs) == 2
+    assert tablebase.getBestMove(gs, gs.getValidMoves()).getChessNotation() == "c1c8"
+
+
+'''
+Qc1-c4 wins, in more half moves than the fifty-move rule leaves once the clock has run
+'''
+def testWinPastTheFiftyMoveRuleIsADraw(tmp_path):
+    def results(board):
+        if board.piece_at(chess.C4) == chess.Piece(chess.QUEEN, chess.WHITE):
+            return -2, -80
+        return -1, -5 #cursed wins for white, draws as well
+    tablebase = makeTablebase(tmp_path, results)
+    for halfmoveClock, expectWin in ((0, True), (30, False)):
+        gs = ChessBitboard.BitboardGameState("k7/8/8/1K6/8/8/8/2Q5 w - - {} 1".format(halfmoveClock))
+        validMoves = gs.getValidMoves()
+        winningMove = findMove(validMoves, "c1c4")
+        validMoves = [move for move in validMoves if move != winningMove] + [winningMove]
+        move = tablebase.getBestMove(gs, validMoves)
+        assert (move == winningMove) == expectWin
+
+
+'''
+tablebasePieces=0 turns the probes off, it is not taken as "use the default"
+'''
+def testSearcherTablebasePieces(tmp_path):
+    (tmp_path / "KQvK.rtbw").touch()
+    assert ChessAI.Searcher(tablebasePath=str(tmp_path)).tablebase.maxPieces == 3
+    assert ChessAI.Searcher(tablebasePath=str(tmp_path), tablebasePieces=0).tablebase.maxPieces == 0
+
+
+@pytest.mark.parametrize("algorithm", ChessAI.SEARCH_ALGORITHMS)
+def testSearchScoresTablebaseWins(tmp_path, algorithm):
+    searcher = ChessAI.Searcher(algorithm)
+    searcher.tablebase = makeTablebase(tmp_path, queenWins)
+    for fen, sign in (("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1", 1), ("7K/8/6k1/8/8/8/8/1q6 b - - 0 1", -1)):
+        gs = ChessBitboard.BitboardGameState(fen)
+        searcher.transpositionTable.clear()
+        searcher.iterativeDeepening(gs, gs.getValidMoves(), 2)
+        assert searcher.searchScore == sign * (ChessAI.TABLEBASE_WIN - 1)
+        assert searcher.tablebase.probes > 0
+
+
+@pytest.mark.skipif(SYZYGY_PATH is None, reason="set SYZYGY_PATH to a directory of Syzygy tables")
+def testRealTables():
+    with Tablebase(SYZYGY_PATH, 3) as tablebase:
+        gs = ChessBitboard.BitboardGameState("k7/8/1K6/8/8/8/8/2Q5 w - - 0 1")
+        assert tablebase.probeWDL(gs) == 2
+        assert tablebase.getBestMove(gs, gs.getValidMoves()).getChessNotation() == "c1c8"
@@ -0,0 +1,72 @@
+from ChessTransposition import TranspositionTable, EXACT, LOWERBOUND, UPPERBOUND
+
+
+'''
+A table and keys that all fall in its first bucket
+'''
+def makeTable(numKeys=4):
+    table = TranspositionTable(0.01)
+    keys = [(i + 1) * table.numBuckets for i in range(numKeys)]
+    return table, keys
+
+
+def testDepthPreferredEntryKeepsTheDeeperSearch():
+    table, (a, b, c, d) = makeTable()
+    table.store(a, 5, 1.5, EXACT, 10)
+    table.store(b, 3, 2.5, LOWERBOUND, 20) #shallower: goes to the always-replace entry
+    assert table.probe(a) == (5, 1.5, EXACT, 10)
+    assert table.probe(b) == (3, 2.5, LOWERBOUND, 20)
+    table.store(c, 2, 3.5, UPPERBOUND, 30) #replaces b, the deep search of a stays
+    assert table.probe(b) is None
+    assert table.probe(a) == (5, 1.5, EXACT, 10)
+    assert table.probe(c) == (2, 3.5, UPPERBOUND, 30)
+    table.store(d, 5, 4.5, EXACT, 40) #as deep as a: takes the depth-preferred entry
+    assert table.probe(a) is None
+    assert table.probe(d) == (5, 4.5, EXACT, 40)
+    assert table.probe(c) == (2, 3.5, UPPERBOUND, 30)
+    assert table.overwrites == 2
+
+
+def testSamePositionIsReplacedWhateverTheDepth():
+    table, (a, _, _, _) = makeTable()
+    table.store(a, 5, 1.5, EXACT, 10)
+    table.store(a, 1, 2.5, LOWERBOUND, None) #no best move: the old one is kept
+    assert table.probe(a) == (1, 2.5, LOWERBOUND, 10)
+    assert table.keys.count(a) == 1
+    assert table.overwrites == 0
+
+
+'''
+A position in the always-replace entry that is searched deep enough moves to the depth-preferred entry, and the
+position there moves to the always-replace one: no position is stored twice and none is lost
+'''
+def testDeeperSearchMovesToTheDepthPreferredEntry():
+    table, (a, b, _, _) = makeTable()
+    table.store(a, 5, 1.5, EXACT, 10)
+    table.store(b, 2, 2.5, EXACT, 20)
+    table.store(b, 7, 3.5, LOWERBOUND, None)
+    assert table.keys[0] == b and table.keys[1] == a
+    assert table.probe(b) == (7, 3.5, LOWERBOUND, 20)
+    assert table.probe(a) == (5, 1.5, EXACT, 10)
+    assert table.overwrites == 0
+    table.store(b, 4, 4.5, EXACT, 30) #shallower, but the same position: replaced in place
+    assert table.keys.count(b) == 1
+    assert table.probe(b) == (4, 4.5, EXACT, 30)
+
+
+def testCounters():
+    table, (a, b, c, _) = makeTable()
+    assert table.probe(a) is None
+    table.store(a, 3, 0., EXACT, None)
+    table.store(b, 2, 0., EXACT, None)
+    table.store(c, 1, 0., EXACT, None) #throws b away
+    assert table.probe(a) is not None
+    assert table.probe(b) is None
+    assert table.getBestMove(c) is None #not counted as a probe
+    stats = table.getStats()
+    assert (stats["hits"], stats["misses"], stats["stores"], stats["overwrites"]) == (1, 2, 3, 1)
+    assert stats["hitRate"] == 1 / 3
+    assert table.getFillRate() == 2 / table.numEntries
+    table.clear()
+    assert table.getStats()["stores"] == 0
+    assert table.probe(a) is None